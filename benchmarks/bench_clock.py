@@ -0,0 +1,84 @@
+"""Micro-benchmark for STimeData.clock.
+
+Compares the integer formatter against the original float/string based
+implementation. Run from the repository root with
+``python -m benchmarks.bench_clock``.
+"""
+import timeit
+
+from stimer.core import STimeData
+
+
+def legacy_clock(seconds, precision=None):
+    if precision is None:
+        precision = 0
+    minutes = seconds / 60
+    hours_left = int(minutes / 60)
+    mins_left = int((seconds / 60) - (60 * hours_left))
+    secs_left = round(seconds % 60, precision)
+    if precision == 0:
+        secs_left = int(secs_left)
+    if secs_left == 60:
+        secs_left = 0
+        mins_left = mins_left + 1
+    if mins_left == 60:
+        mins_left = 0
+        hours_left = hours_left + 1
+    clock_format = []
+    clock_format.append(str(hours_left))
+    clock_format.append(str(mins_left))
+    if precision == 0:
+        clock_format.append(str(secs_left))
+    else:
+        clock_format.append(format(secs_left, "." + str(precision) + "f"))
+    clock_str = ""
+    for s in clock_format:
+        whole_split = s.split(".")[0]
+        if len(whole_split) < 2:
+            s = "0" + s
+        clock_str = clock_str + s + ":"
+    clock_str = clock_str[:-1]
+    return clock_str
+
+
+def bench(label, func, values, precision, number=1):
+    def run():
+        for value in values:
+            func(value, precision)
+
+    best = min(timeit.repeat(run, number=number, repeat=7))
+    per_call = best / (number * len(values)) * 1e9
+    print("{:<28} {:>10.1f} ns/call".format(label, per_call))
+    return per_call
+
+
+def main():
+    # One frame per 10ms of a 200 second timer, the access pattern of a render
+    # loop where consecutive frames often quantize to the same value.
+    frames = [i / 100 for i in range(20000)]
+    # Values that never repeat, so the cache cannot help.
+    spread = [i * 7.123457 for i in range(20000)]
+
+    for precision in (0, 2):
+        for values, name in ((frames, "frames"), (spread, "spread")):
+            for value in values[:1000]:
+                assert legacy_clock(value, precision) == STimeData(value).clock(
+                    precision
+                )
+            old = bench(
+                "legacy p={} {}".format(precision, name),
+                legacy_clock,
+                values,
+                precision,
+            )
+            new = bench(
+                "STimeData p={} {}".format(precision, name),
+                lambda value, precision: STimeData(value).clock(precision),
+                values,
+                precision,
+            )
+            print("{:<28} {:>10.2f}x".format("speedup", old / new))
+
+
+if __name__ == "__main__":
+    main()
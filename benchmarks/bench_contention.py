@@ -0,0 +1,93 @@
+"""Benchmark for parallel stimer processes writing the same config.
+
+Forks WRITERS processes that each save TIMERS named timers into one
+temporary config directory at the same time, the way parallel CI jobs run
+``stimer -S``. It reports saves per second over all writers and how many
+timers are missing afterwards, with the config lock and with locking
+switched off. Run from the repository root with
+``python -m benchmarks.bench_contention [WRITERS] [TIMERS]``.
+"""
+import multiprocessing
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_store import use_config_dir
+from stimer import confighandler
+from stimer.core import STimer
+
+WRITERS = 16
+TIMERS = 50
+
+
+def write_timers(config_dir, writer, count, barrier, locked):
+    use_config_dir(config_dir)
+    if not locked:
+        confighandler.fcntl = None
+    barrier.wait()
+    for i in range(count):
+        timer = STimer(duration=i + 1, name="w{}_{}".format(writer, i))
+        confighandler.save_timer(timer)
+
+
+def bench_contention(writers, count, locked=True, backend="config"):
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as config_dir:
+        use_config_dir(config_dir)
+        confighandler.write_value("timer_store", '"{}"'.format(backend))
+        confighandler.get_defaults()
+        barrier = context.Barrier(writers + 1)
+        processes = [
+            context.Process(
+                target=write_timers,
+                args=(config_dir, writer, count, barrier, locked),
+            )
+            for writer in range(writers)
+        ]
+        for process in processes:
+            process.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        confighandler._config_cache["key"] = None
+        for store in confighandler._timer_stores.values():
+            store.close()
+        confighandler._timer_stores.clear()
+        saved = len(confighandler.get_timers_list())
+    return {
+        "saves/s": writers * count / elapsed,
+        "lost": writers * count - saved,
+        "seconds": elapsed,
+    }
+
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else WRITERS
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else TIMERS
+    print("{} writers x {} timers, saves/s over all writers\n".format(writers, count))
+    print(
+        "{:<10} {:<8} {:>10} {:>8} {:>9}".format(
+            "store", "lock", "saves/s", "lost", "seconds"
+        )
+    )
+    backends = ["config"]
+    if confighandler.SQLITE_AVAILABLE:
+        backends.append("sqlite")
+    for backend in backends:
+        for locked in (True, False):
+            result = bench_contention(writers, count, locked, backend)
+            print(
+                "{:<10} {:<8} {:>10.0f} {:>8} {:>9.2f}".format(
+                    backend,
+                    "flock" if locked else "none",
+                    result["saves/s"],
+                    result["lost"],
+                    result["seconds"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
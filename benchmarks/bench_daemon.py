@@ -0,0 +1,79 @@
+"""Benchmark for stimer daemon requests.
+
+Runs a daemon in a background thread on a temporary socket, fills it with
+running timers and times client round trips for ping, start, get, cancel and
+list at several daemon sizes. Run from the repository root with
+``python -m benchmarks.bench_daemon``.
+"""
+import asyncio
+import tempfile
+import threading
+import time
+
+from stimer.client import DaemonClient
+from stimer.core import STimer
+from stimer.daemon import STimerDaemon
+
+SIZES = (10, 1000, 10000)
+
+
+def timed(func, repeat=50):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e3
+
+
+def bench_size(size):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = tmp_dir + "/stimer.sock"
+        thread = threading.Thread(
+            target=asyncio.run, args=(STimerDaemon(socket_path).serve(),)
+        )
+        thread.start()
+        client = DaemonClient(socket_path)
+        while not client.running():
+            time.sleep(0.01)
+        timer = STimer(duration=3600, sound=False)
+        for _ in range(size):
+            client.start(timer)
+        timer_id = client.start(timer)["id"]
+
+        def start_cancel():
+            client.cancel(client.start(timer)["id"])
+
+        results = {
+            "ping": timed(lambda: client.request("ping")),
+            "get": timed(lambda: client.get(timer_id)),
+            "start+cancel": timed(start_cancel),
+            "list": timed(client.list, repeat=3),
+        }
+        client.shutdown()
+        thread.join()
+    return results
+
+
+def main():
+    print(
+        "{:>7} {:>9} {:>8} {:>15} {:>9}".format(
+            "timers", "ping ms", "get ms", "start+cancel ms", "list ms"
+        )
+    )
+    for size in SIZES:
+        results = bench_size(size)
+        print(
+            "{:>7} {:>9.3f} {:>8.3f} {:>15.3f} {:>9.2f}".format(
+                size,
+                results["ping"],
+                results["get"],
+                results["start+cancel"],
+                results["list"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark for parse_duration.
+
+Compares the single-pass scanner against the original regex based parser on
+ordinary durations and on strings that make the old regexes backtrack. Run
+from the repository root with ``python -m benchmarks.bench_parse``.
+"""
+import re
+import timeit
+
+from stimer.core import parse_duration
+
+
+def legacy_parse_duration(duration):
+    def to_float(decimal_time):
+        time = 0.0
+        splits = decimal_time.split(".")
+        if splits[0] != "":
+            time = time + float(splits[0])
+        if len(splits) > 1 and splits[1] != "":
+            new_time = "0." + splits[1]
+            time = time + float(new_time)
+        return time
+
+    char_regex = r"(?i)(?=^[\d\.hms]*[hms][\d\.hms]*$)([\d\.[hms]*[hms][\d\.hms]*){1,3}"
+    clock_regex = r"^((?=((:)|(\d+)))(:?\d*\.?\d*){1,3})$"
+    char_match = re.match(re.compile(char_regex), duration)
+    clock_match = re.match(re.compile(clock_regex), duration)
+
+    seconds = 0.0
+    if char_match:
+        hours_match = re.findall(re.compile(r"(?i)\d*\.?\d*h"), duration)
+        mins_match = re.findall(re.compile(r"(?i)\d*\.?\d*m"), duration)
+        secs_match = re.findall(
+            re.compile(r"(?i)((\d*\.?\d*s)|(\d*\.?\d*$))"), duration
+        )
+        if hours_match:
+            hours = 0.0
+            for match in hours_match:
+                hours = hours + float(match[:-1])
+            seconds = seconds + (hours * 60 * 60)
+        if mins_match:
+            mins = 0.0
+            for match in mins_match:
+                mins = mins + float(match[:-1])
+            seconds = seconds + (mins * 60)
+        if secs_match:
+            for match in secs_match:
+                first_group = match[0]
+                if len(first_group) > 0:
+                    if first_group[-1] == "s":
+                        first_group = first_group[:-1]
+                    seconds = seconds + float(first_group)
+    elif clock_match:
+        duration_splits = duration.split(":")
+        duration_splits.reverse()
+        multiplier = 1
+        for split in duration_splits:
+            seconds = seconds + (multiplier * to_float(split))
+            multiplier = multiplier * 60
+    else:
+        return None
+    return seconds
+
+
+def bench(func, duration, number):
+    best = min(timeit.repeat(lambda: func(duration), number=number, repeat=3))
+    return best / number * 1e6
+
+
+def main():
+    print("{:<24} {:>14} {:>14}".format("duration", "legacy us", "scanner us"))
+    for duration in ("20", "4h3s", "66h400.125m5.6s", "5.1:22.110:400.5"):
+        print(
+            "{:<24} {:>14.2f} {:>14.2f}".format(
+                duration,
+                bench(legacy_parse_duration, duration, 2000),
+                bench(parse_duration, duration, 2000),
+            )
+        )
+
+    print()
+    print("{:<24} {:>14} {:>14}".format("pathological", "legacy us", "scanner us"))
+    cases = {
+        "digits then junk": lambda n: "1" * n + "a",
+        "digits then clock": lambda n: "1" * n + ":1:1:1",
+    }
+    for name, make in cases.items():
+        for length in (10, 20, 30, 10000):
+            duration = make(length)
+            if length <= 30:
+                legacy = "{:>14.2f}".format(bench(legacy_parse_duration, duration, 1))
+            else:
+                legacy = "{:>14}".format("skipped")
+            scanner = bench(parse_duration, duration, 10)
+            label = "{} x{}".format(name, length)
+            print("{:<24} {} {:>14.2f}".format(label, legacy, scanner))
+
+
+if __name__ == "__main__":
+    main()
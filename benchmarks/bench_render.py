@@ -0,0 +1,141 @@
+"""Benchmark for the timer line renderers.
+
+Feeds the frames of a 60 second, 0.1 precision countdown to the native
+ANSIRenderer and to progressbar2 on a pseudo-terminal. It reports CPU time per
+frame, writes per frame and bytes per frame. Run from the repository root with
+``python -m benchmarks.bench_render``.
+"""
+import os
+import pty
+import threading
+import time
+
+from stimer.core import STimeData
+from stimer.output import BAR_MARKER, ANSIRenderer
+
+DURATION = 60
+PRECISION = 1
+WIDGETS = ["remaining", "bar", "elapsed"]
+
+
+def frames():
+    step = 10**-PRECISION
+    for i in range(int(DURATION / step) + 1):
+        elapsed = i * step
+        remaining = DURATION - elapsed
+        yield remaining, {
+            "remaining": STimeData(remaining).clock(PRECISION),
+            "elapsed": STimeData(elapsed).clock(PRECISION),
+        }
+
+
+class CountingStream:
+    def __init__(self, fd):
+        self.fd = fd
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, data):
+        data = data.encode("utf-8")
+        self.writes = self.writes + 1
+        self.bytes = self.bytes + len(data)
+        while data:
+            data = data[os.write(self.fd, data) :]
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return True
+
+    def fileno(self):
+        return self.fd
+
+
+def drain(master_fd, stop):
+    while not stop.is_set():
+        try:
+            os.read(master_fd, 65536)
+        except OSError:
+            return
+
+
+def run(name, make_bar, counter):
+    master_fd, slave_fd = pty.openpty()
+    stop = threading.Event()
+    reader = threading.Thread(target=drain, args=(master_fd, stop), daemon=True)
+    reader.start()
+    frame_list = list(frames())
+    bar = make_bar(slave_fd)
+    start = time.process_time()
+    for value, variables in frame_list:
+        bar.update(value, **variables)
+    cpu = time.process_time() - start
+    bar.finish(dirty=True)
+    writes, written = counter(bar)
+    stop.set()
+    os.close(slave_fd)
+    os.close(master_fd)
+    count = len(frame_list)
+    print(
+        "{:<12} {:>8} {:>14.1f} {:>14.2f} {:>14.1f}".format(
+            name, count, cpu / count * 1e6, writes / count, written / count
+        )
+    )
+
+
+def main():
+    print(
+        "{:<12} {:>8} {:>14} {:>14} {:>14}".format(
+            "renderer", "frames", "cpu us/frame", "writes/frame", "bytes/frame"
+        )
+    )
+
+    native_counts = {"writes": 0, "bytes": 0}
+    real_write = os.write
+
+    def counting_write(fd, data):
+        native_counts["writes"] = native_counts["writes"] + 1
+        native_counts["bytes"] = native_counts["bytes"] + len(data)
+        return real_write(fd, data)
+
+    def make_native(fd):
+        renderer = ANSIRenderer(WIDGETS, max_value=DURATION, fd=fd)
+        renderer.term_width = 80
+        os.write = counting_write
+        return renderer
+
+    def count_native(renderer):
+        os.write = real_write
+        return native_counts["writes"], native_counts["bytes"]
+
+    run("native", make_native, count_native)
+
+    try:
+        import progressbar
+    except ImportError:
+        print("progressbar2 not installed, skipping")
+        return
+
+    def make_progressbar(fd):
+        widgets = [
+            progressbar.Variable(name="remaining", format="{value}"),
+            progressbar.Bar(marker=BAR_MARKER, left=" ", right=" "),
+            progressbar.Variable(name="elapsed", format="{value}"),
+        ]
+        return progressbar.ProgressBar(
+            max_value=DURATION,
+            widgets=widgets,
+            fd=CountingStream(fd),
+            term_width=80,
+            variables={"remaining": "", "elapsed": ""},
+        )
+
+    def count_progressbar(bar):
+        return bar.fd.writes, bar.fd.bytes
+
+    run("progressbar2", make_progressbar, count_progressbar)
+
+
+if __name__ == "__main__":
+    main()
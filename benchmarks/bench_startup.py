@@ -0,0 +1,114 @@
+"""Cold-start benchmark for the stimer entry point.
+
+Runs each subcommand in a fresh interpreter with ``-X importtime`` against a
+temporary HOME. It reports wall time, total import time and whether any
+render-only module was loaded. Commands that do not render must not import
+those modules; the script exits non-zero if one does. Run from the
+repository root with ``python -m benchmarks.bench_startup [--json FILE]``.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+REPEAT = 5
+# Modules only the rendering path should pay for, as in TestLazyImports.
+# stimer.timerstore itself is light and always loaded; it defers sqlite3.
+RENDER_MODULES = ("stimer.output", "stimer.engine", "sqlite3", "numpy", "asyncio")
+SAVE = ["-S", "5m", "-n", "bench"]
+REMOVE = ["-r", "bench"]
+# (name, arguments, untimed setup run before each repeat, renders)
+COMMANDS = [
+    ("version", ["--version"], None, False),
+    ("help", ["--help"], None, False),
+    ("save-only", SAVE, REMOVE, False),
+    ("list", ["--list"], SAVE, False),
+    ("remove", REMOVE, SAVE, False),
+    ("run", ["-a", "-o", "0.05"], None, True),
+]
+
+
+def parse_importtime(stderr):
+    total_us = 0
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:") :].split("|")
+        if not fields[1].strip().isdigit():
+            continue
+        name = fields[2]
+        modules.add(name.strip())
+        if not name[1:].startswith(" "):
+            total_us = total_us + int(fields[1])
+    return total_us, modules
+
+
+def run_command(args, home):
+    env = dict(os.environ)
+    env["HOME"] = home
+    env["PYTHONPATH"] = str(ROOT)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "stimer"] + args,
+        env=env,
+        cwd=str(ROOT),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    wall = time.perf_counter() - start
+    import_us, modules = parse_importtime(proc.stderr)
+    return wall * 1e3, import_us / 1e3, modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    failed = False
+    print(
+        "{:<10} {:>10} {:>10}  {}".format("command", "wall ms", "import ms", "render")
+    )
+    with tempfile.TemporaryDirectory() as home:
+        for name, command, setup, renders in COMMANDS:
+            walls = []
+            imports = []
+            loaded = set()
+            for _ in range(REPEAT):
+                if setup:
+                    run_command(setup, home)
+                wall, import_ms, modules = run_command(command, home)
+                walls.append(wall)
+                imports.append(import_ms)
+                loaded = loaded | (modules & set(RENDER_MODULES))
+            results[name] = {
+                "wall_ms": min(walls),
+                "import_ms": min(imports),
+                "render_modules": sorted(loaded),
+            }
+            if loaded and not renders:
+                failed = True
+            print(
+                "{:<10} {:>10.1f} {:>10.1f}  {}".format(
+                    name, min(walls), min(imports), ", ".join(sorted(loaded)) or "-"
+                )
+            )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if failed:
+        print("Render-only modules were imported by a non-render command.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
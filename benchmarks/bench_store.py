@@ -0,0 +1,95 @@
+"""Benchmark for the saved timer stores.
+
+Times save_timer, load_timer, get_timers_list and remove_timer against the
+stimer.conf TIMERS section and the SQLite store at several store sizes. The
+config lives in a temporary directory. Run from the repository root with
+``python -m benchmarks.bench_store``.
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from stimer import confighandler
+from stimer.core import STimer
+
+SIZES = (100, 1000, 10000)
+
+
+def use_config_dir(config_dir):
+    confighandler.CONFIG_DIR = config_dir + "/"
+    confighandler.CONFIG_FILE = Path(config_dir, confighandler.CONFIG_FILENAME)
+    confighandler._config_cache["key"] = None
+
+
+def timed(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e3
+
+
+def bench_backend(backend, size):
+    with tempfile.TemporaryDirectory() as config_dir:
+        use_config_dir(config_dir)
+        confighandler.write_value("timer_store", '"{}"'.format(backend))
+        store = confighandler._timer_store()
+        timer_json = STimer(duration=90, sound=False).to_json()
+        store.put_many(("timer{}".format(i), timer_json) for i in range(size))
+
+        def save():
+            name = confighandler.save_timer(STimer(duration=30))
+            confighandler.remove_timer(name)
+
+        def cold_load():
+            # What a fresh stimer process pays: nothing parsed or connected.
+            confighandler._config_cache["key"] = None
+            for store in confighandler._timer_stores.values():
+                store.close()
+            confighandler.load_timer("timer{}".format(size // 2))
+
+        results = {
+            "cold load": timed(cold_load),
+            "save+remove": timed(save),
+            "load": timed(
+                lambda: confighandler.load_timer("timer{}".format(size // 2))
+            ),
+            "list": timed(confighandler.get_timers_list, repeat=3),
+        }
+        for store in confighandler._timer_stores.values():
+            store.close()
+        confighandler._timer_stores.clear()
+    return results
+
+
+def main():
+    backends = ["config"]
+    if confighandler.SQLITE_AVAILABLE:
+        backends.append("sqlite")
+    else:
+        print("sqlite3 not available, skipping SQLite store", file=sys.stderr)
+    print(
+        "{:<8} {:>7} {:>14} {:>12} {:>10} {:>10}".format(
+            "store", "timers", "save+remove ms", "cold load ms", "load ms", "list ms"
+        )
+    )
+    for backend in backends:
+        for size in SIZES:
+            results = bench_backend(backend, size)
+            print(
+                "{:<8} {:>7} {:>14.2f} {:>12.3f} {:>10.3f} {:>10.2f}".format(
+                    backend,
+                    size,
+                    results["save+remove"],
+                    results["cold load"],
+                    results["load"],
+                    results["list"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Benchmark suite with JSON results.
+
+Covers parse_duration, STimeData.clock, clock_batch, STimer queries, the STimerOutput
+render loop and the confighandler timer operations at 10, 1k and 10k saved
+timers. Every result is one named number, so two result files can be
+compared. Run from the repository root with
+
+    python -m benchmarks.suite [--output FILE] [--compare BASELINE] [--quick]
+
+``--compare`` prints the ratio of every result to the baseline and exits
+non-zero if any result is worse by more than ``--threshold``. Runs offline
+against a temporary config directory; the render loop runs on a virtual
+clock and a pseudo-terminal, so it takes CPU time only.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import pty
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+from benchmarks.bench_store import bench_backend, use_config_dir
+from stimer import confighandler
+from stimer.core import ManualClock, STimeData, STimer, clock_batch, parse_duration
+from stimer.output import STimerOutput
+from stimer.plan import compile_plan
+
+DURATIONS = ("20", "4h3s", "66h400.125m5.6s", "5.1:22.110:400.5")
+STORE_SIZES = (10, 1000, 10000)
+# Higher is better for these units; everything else is a cost.
+HIGHER_IS_BETTER = {"frames/s"}
+
+
+def per_call_ns(func, number, repeat=5):
+    best = min(timeit.repeat(func, number=number, repeat=repeat))
+    return best / number * 1e9
+
+
+def bench_parse(results, quick):
+    number = 2000 if quick else 20000
+    for duration in DURATIONS:
+        results["parse_duration/" + duration] = (
+            per_call_ns(lambda: parse_duration(duration), number),
+            "ns/call",
+        )
+
+
+def bench_clock(results, quick):
+    count = 2000 if quick else 20000
+    # Consecutive render frames, then values that never repeat.
+    cases = {
+        "frames": [i / 100 for i in range(count)],
+        "spread": [i * 7.123457 for i in range(count)],
+    }
+    for precision in (0, 2):
+        for name, values in cases.items():
+
+            def run():
+                for value in values:
+                    STimeData(value).clock(precision)
+
+            key = "clock/p{}_{}".format(precision, name)
+            results[key] = (per_call_ns(run, 1) / len(values), "ns/call")
+
+            key = "clock_batch/p{}_{}".format(precision, name)
+            results[key] = (
+                per_call_ns(lambda: clock_batch(values, precision), 1) / len(values),
+                "ns/value",
+            )
+
+
+def bench_queries(results, quick):
+    number = 2000 if quick else 20000
+    timer = STimer(duration=3600)
+    timer.start()
+    results["timer/elapsed"] = (per_call_ns(timer.elapsed, number), "ns/call")
+    results["timer/remaining"] = (per_call_ns(timer.remaining, number), "ns/call")
+    results["timer/snapshot"] = (per_call_ns(timer.snapshot, number), "ns/call")
+    plan = compile_plan(timer, confighandler.DEFAULTS)
+    results["timer/plan_snapshot"] = (
+        per_call_ns(lambda: plan.snapshot(timer.elapsed_ns()), number),
+        "ns/call",
+    )
+
+    def snapshot_clocks():
+        snap = timer.snapshot()
+        return snap.remaining_clock, snap.elapsed_clock
+
+    results["timer/snapshot_clocks"] = (per_call_ns(snapshot_clocks, number), "ns/call")
+
+
+@contextlib.contextmanager
+def stderr_to_pty():
+    # STimerOutput draws on stderr; point it at a drained pseudo-terminal.
+    master_fd, slave_fd = pty.openpty()
+    stop = threading.Event()
+
+    def drain():
+        while not stop.is_set():
+            try:
+                os.read(master_fd, 65536)
+            except OSError:
+                return
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    saved_fd = os.dup(2)
+    os.dup2(slave_fd, 2)
+    try:
+        yield
+    finally:
+        os.dup2(saved_fd, 2)
+        os.close(saved_fd)
+        stop.set()
+        os.close(slave_fd)
+        os.close(master_fd)
+
+
+def bench_output(results, quick):
+    minutes = 1 if quick else 10
+    for precision in (0, 1, 2):
+        clock = ManualClock()
+        timer = STimer(clock=clock, duration=minutes * 60, precision=precision)
+        timer.sound = False
+        timer.start()
+        output = STimerOutput(timer, renderer="native")
+        frames = {"count": 0}
+        real_write = os.write
+
+        def counting_write(fd, data):
+            frames["count"] = frames["count"] + 1
+            return real_write(fd, data)
+
+        with stderr_to_pty(), contextlib.redirect_stdout(io.StringIO()):
+            os.write = counting_write
+            try:
+                start = time.process_time()
+                output.start_output()
+                cpu = time.process_time() - start
+            finally:
+                os.write = real_write
+        key = "output/p{}".format(precision)
+        # Redraws the terminal has to take per second of countdown, how many
+        # frames one CPU second renders, and CPU seconds per timer minute.
+        results[key + "_writes_per_timer_second"] = (
+            frames["count"] / (minutes * 60),
+            "writes/s",
+        )
+        results[key + "_frames_per_cpu_second"] = (frames["count"] / cpu, "frames/s")
+        results[key + "_cpu_per_timer_minute"] = (cpu / minutes, "s")
+
+
+def bench_config(results, quick):
+    backends = ["config"]
+    if confighandler.SQLITE_AVAILABLE:
+        backends.append("sqlite")
+    sizes = STORE_SIZES[:2] if quick else STORE_SIZES
+    for backend in backends:
+        for size in sizes:
+            for name, value in bench_backend(backend, size).items():
+                key = "config/{}_{}_{}".format(backend, size, name.replace(" ", "_"))
+                results[key] = (value, "ms")
+
+
+BENCHMARKS = [
+    ("parse", bench_parse),
+    ("clock", bench_clock),
+    ("queries", bench_queries),
+    ("output", bench_output),
+    ("config", bench_config),
+]
+
+
+def run_suite(quick=False, only=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as config_dir:
+        # Defaults for STimerOutput come from a throwaway config.
+        use_config_dir(config_dir)
+        for name, bench in BENCHMARKS:
+            if only and name not in only:
+                continue
+            print("running " + name, file=sys.stderr)
+            bench(results, quick)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "quick": quick,
+        },
+        "results": {
+            key: {"value": value, "unit": unit}
+            for key, (value, unit) in sorted(results.items())
+        },
+    }
+
+
+def compare(report, baseline, threshold):
+    regressions = []
+    print("{:<44} {:>12} {:>12} {:>8}".format("benchmark", "baseline", "now", "ratio"))
+    for key, result in report["results"].items():
+        if key not in baseline["results"]:
+            continue
+        old = baseline["results"][key]["value"]
+        new = result["value"]
+        if not old or not new:
+            continue
+        # Ratio > 1 always means worse.
+        if result["unit"] in HIGHER_IS_BETTER:
+            ratio = old / new
+        else:
+            ratio = new / old
+        flag = ""
+        if ratio > threshold:
+            flag = " !"
+            regressions.append(key)
+        print(
+            "{:<44} {:>12.4g} {:>12.4g} {:>8.2f}{}".format(key, old, new, ratio, flag)
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write results as JSON to FILE")
+    parser.add_argument("--compare", help="compare with a results FILE")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    parser.add_argument("--quick", action="store_true", help="smaller inputs")
+    parser.add_argument(
+        "--only", action="append", choices=[name for name, bench in BENCHMARKS]
+    )
+    args = parser.parse_args()
+
+    report = run_suite(args.quick, args.only)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print("{} regressions over {}x".format(len(regressions), args.threshold))
+            sys.exit(1)
+    elif not args.output:
+        for key, result in report["results"].items():
+            print("{:<44} {:>12.4g} {}".format(key, result["value"], result["unit"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -21,7 +21,7 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     packages=setuptools.find_packages(),
-    install_requires=["progressbar2"],
+    extras_require={"progressbar": ["progressbar2"]},
     python_requires=">=3.7",
     entry_points={
         "console_scripts": ["stimer=stimer.__main__:main"],
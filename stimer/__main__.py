@@ -1,24 +1,38 @@
 import sys
+import os
+import json
+import heapq
 import logging
 import argparse
+import itertools
 
-from .core import STimer, TimeFormat, parse_duration
-from .output import STimerOutput
+from .core import STimer, TimeFormat, DurationParseError, parse_duration
 from .confighandler import (
+    clear_running,
+    config_batch,
+    get_defaults,
+    get_orphaned_timers,
+    record_running,
+    resume_running,
     save_timer,
     load_timer,
-    get_timers_list,
+    iter_timers,
     remove_timer,
+    import_timers,
+    export_timers,
 )
 
 VERSION = "v0.2.1"
+# Seconds a foreground timer must have left to be recorded for --resume.
+RESUME_MIN_REMAINING = 5
 
 HELP_MSGS = {
     "duration": (
         'Duration of timer in "hms" format or "clock" format.\n'
         "    hms format -> #h#m#s\n"
         "    clock format -> ##:##:##\n"
-        'See "--help-duration"'
+        'See "--help-duration"\n'
+        "Several durations run several timers at once."
     ),
     "up": "count up (stopwatch mode), duration not required",
     "down": "count down (timer mode), default; useful to override saved timers",
@@ -30,9 +44,34 @@ HELP_MSGS = {
     "save": "save timer",
     "save_only": "save timer and do not run",
     "remove": "remove saved timer",
-    "list": "list saved timers",
+    "list": "list saved timers, or those whose name starts with PATTERN\n"
+    'or matches it as a glob ("*", "?", "[...]")',
+    "sort": "sort the list by KEY {name, duration}",
+    "reverse": "reverse the list order",
+    "limit": "list at most N timers",
+    "import": 'import saved timers from JSON lines in FILE ("-" for stdin)',
+    "export": "export saved timers as JSON lines to FILE; default stdout",
+    "overwrite": "replace saved timers with the same name on import;\n"
+    "by default they are skipped",
     "name": "name timer when saving",
-    "timer": "run timer",
+    "timer": "run saved timer; repeat to run several",
+    "background": "run timer in the stimer daemon, started if needed",
+    "jobs": "list timers running in the stimer daemon",
+    "attach": "show progress of a timer running in the stimer daemon",
+    "cancel": "cancel a timer running in the stimer daemon",
+    "daemon": "start the stimer daemon",
+    "stop_daemon": "stop the stimer daemon and its timers",
+    "resume": "resume timers that were running when stimer was killed",
+    "json": "write JSON-line events instead of a progress bar;\n"
+    "default when stdout is not a terminal; with --list, one JSON\n"
+    "line per saved timer",
+    "interval": "seconds between JSON-line tick events; default 10",
+    "stats": "print render statistics on exit or on SIGUSR1",
+    "precise": "spin for the last moments before expiry for sub-millisecond\n"
+    "accuracy and report the firing error",
+    "laps": "record a lap for every line read from stdin, or every key\n"
+    "pressed in a terminal; write them to FILE (.csv or binary int64 ns);\n"
+    "count-up mode only",
     "help_duration": (
         "Timer DURATION can be specified in 2 formats:\n"
         "\n"
@@ -65,43 +104,173 @@ HELP_MSGS = {
 }
 
 
-def list_timers():
-    timers = get_timers_list()
+def list_jobs(client):
+    response = daemon_request(client.list)
+    rows = [("ID", "Label", "Elapsed", "Remaining")]
+    column_len = [len(entry) for entry in rows[0]]
+    for info in response["timers"]:
+        row = [str(info["id"]), info["label"], info["elapsed"], info["remaining"] or ""]
+        for i, entry in enumerate(row):
+            column_len[i] = max(len(entry), column_len[i])
+        rows.append(row)
+    print_table(rows, column_len)
+
+
+def daemon_request(method, *args):
+    response = method(*args)
+    if response is None:
+        print('stimer daemon is not running. Start it with "stimer --daemon".')
+        sys.exit(0)
+    if response["ok"] is False:
+        print(response["error"])
+        sys.exit(0)
+    return response
+
+
+def daemon_command(args):
+    # Imported here so the plain timer path never loads the socket client.
+    from .client import DaemonClient
+
+    client = DaemonClient()
+    if args.daemon:
+        from .daemon import spawn_daemon
+
+        if spawn_daemon():
+            print("stimer daemon started.")
+        else:
+            print("stimer daemon already running.")
+    elif args.stop_daemon:
+        daemon_request(client.shutdown)
+        print("stimer daemon stopped.")
+    elif args.jobs:
+        list_jobs(client)
+    elif args.cancel is not None:
+        daemon_request(client.cancel, args.cancel)
+        print("Timer " + str(args.cancel) + " cancelled.")
+    elif args.attach is not None:
+        response = daemon_request(client.get, args.attach)
+        timer = STimer.from_json(response["timer"])
+        timer.start(response["elapsed_ns"])
+        from .output import STimerOutput
+
+        STimerOutput(
+            timer, label=response["label"] + " ", **output_options(args)
+        ).start_output()
+
+
+def start_background(labeled_timers):
+    from .client import DaemonClient
+    from .daemon import spawn_daemon
+
+    spawn_daemon()
+    client = DaemonClient()
+    for label, timer in labeled_timers:
+        response = daemon_request(client.start, timer, label)
+        print("Timer " + str(response["id"]) + " started in background.")
+
+
+SORT_KEYS = {
+    "name": lambda item: item[0],
+    # Stopwatches have no duration and sort last.
+    "duration": lambda item: (item[1].duration() is None, item[1].duration() or 0),
+}
+
+
+def list_timers(args):
+    # Timers are read one at a time; only sorting needs them all, and with a
+    # limit it keeps just the first LIMIT.
+    timers = iter_timers(args.list)
+    if args.sort:
+        key = SORT_KEYS[args.sort]
+        if args.limit is not None:
+            select = heapq.nlargest if args.reverse else heapq.nsmallest
+            timers = select(args.limit, timers, key=key)
+        else:
+            timers = sorted(timers, key=key, reverse=args.reverse)
+    elif args.reverse:
+        timers = reversed(list(timers))
+    if args.limit is not None:
+        timers = itertools.islice(timers, args.limit)
+    if args.json:
+        for name, timer in timers:
+            data = timer.option_dict
+            data["name"] = name
+            sys.stdout.write(json.dumps(data) + "\n")
+        return
     rows = [("Name", "Duration", "Options")]
-    column_len = [4, 8, 7]
-    for timer in timers:
-        name = timer[0]
-        stimer = timer[1]
-        options = stimer.option_dict
-        row = [name]
-        column_len[0] = max(len(row[0]), column_len[0])
-        if stimer.duration():
-            row.append(stimer.duration(TimeFormat.CLOCK))
+    rows.extend(timer_row(name, timer) for name, timer in timers)
+    column_len = [max(len(row[i]) for row in rows) for i in range(3)]
+    print_table(rows, column_len)
+
+
+def timer_row(name, stimer):
+    options = stimer.option_dict
+    row = [name]
+    if options["duration"]:
+        row.append(stimer.duration(TimeFormat.CLOCK))
+    else:
+        row.append("")
+    options_entries = []
+    if options["up"] is not None:
+        if options["up"] is True:
+            options_entries.append("up")
         else:
-            row.append("")
-        column_len[1] = max(len(row[1]), column_len[1])
-        options_entries = []
-        if options["up"] is not None:
-            if options["up"] is True:
-                options_entries.append("up")
-            else:
-                options_entries.append("down")
-        if options["sound"] is not None:
-            if options["sound"] is True:
-                options_entries.append("sound")
-            else:
-                options_entries.append("no sound")
-        if options["widget_fmt"]:
-            if options["widget_fmt"] == "simple":
-                options_entries.append("simple")
-            elif options["widget_fmt"] == "full":
-                options_entries.append("full")
-        if options["precision"] is not None:
-            options_entries.append("precision " + str(options["precision"]))
-        options_str = ", ".join(options_entries)
-        row.append(options_str)
-        column_len[2] = max(len(row[2]), column_len[2])
-        rows.append(row)
+            options_entries.append("down")
+    if options["sound"] is not None:
+        if options["sound"] is True:
+            options_entries.append("sound")
+        else:
+            options_entries.append("no sound")
+    if options["widget_fmt"]:
+        if options["widget_fmt"] == "simple":
+            options_entries.append("simple")
+        elif options["widget_fmt"] == "full":
+            options_entries.append("full")
+    if options["precision"] is not None:
+        options_entries.append("precision " + str(options["precision"]))
+    row.append(", ".join(options_entries))
+    return row
+
+
+def import_file(path, overwrite):
+    try:
+        if path == "-":
+            counts = import_timers(sys.stdin, overwrite)
+        else:
+            with open(path) as f:
+                counts = import_timers(f, overwrite)
+    except OSError as e:
+        print("Timers could not be imported: " + str(e))
+        sys.exit(0)
+    message = "Imported {} timers".format(counts["imported"])
+    details = []
+    if counts["overwritten"]:
+        details.append("{} overwritten".format(counts["overwritten"]))
+    if counts["skipped"]:
+        details.append("{} existing skipped".format(counts["skipped"]))
+    if counts["invalid"]:
+        details.append("{} invalid".format(counts["invalid"]))
+    if details:
+        message = message + " (" + ", ".join(details) + ")"
+    print(message + ".")
+    if counts["skipped"]:
+        print('Use "--overwrite" to replace existing timers.')
+
+
+def export_file(path):
+    if path == "-":
+        export_timers(sys.stdout)
+        return
+    try:
+        with open(path, "w") as f:
+            count = export_timers(f)
+    except OSError as e:
+        print("Timers could not be exported: " + str(e))
+        sys.exit(0)
+    print("Exported {} timers to {}.".format(count, path))
+
+
+def print_table(rows, column_len):
     line_len = 0
     for i, row in enumerate(rows):
         row_str = "| "
@@ -117,14 +286,18 @@ def list_timers():
         print(row)
 
 
-def set_timer_options(args, timer):
+def set_timer_options(args, timer, duration_str=None):
     args_options = {}
-    if args.duration:
-        duration = parse_duration(args.duration)
-        if duration is None:
+    if duration_str:
+        try:
+            duration = parse_duration(duration_str, strict=True)
+        except DurationParseError as e:
+            print("Duration could not be parsed. " + str(e) + ":")
+            print("    " + duration_str)
+            print("    " + " " * e.position + "^")
             print(
-                "Duration could not be parsed. Duration must be in character "
-                'format "#h#m#s.###" or clock format "##:##:##.###".'
+                'Duration must be in character format "#h#m#s.###" '
+                'or clock format "##:##:##.###".'
             )
             sys.exit(0)
         args_options["duration"] = duration
@@ -159,10 +332,79 @@ def set_timer_options(args, timer):
                 print('No duration specified. Assuming "UP" (stopwatch) mode.')
 
 
+def build_timers(args, timers, durations):
+    # One saved timer with at most one duration is the saved timer with its
+    # duration overridden; otherwise every name and duration is its own timer.
+    if len(timers) == 1 and len(durations) <= 1:
+        name, timer = timers[0]
+        set_timer_options(args, timer, durations[0] if durations else None)
+        return [(name, timer)]
+    if not timers and not durations:
+        timer = STimer()
+        set_timer_options(args, timer)
+        return [(None, timer)]
+    labeled_timers = []
+    for name, timer in timers:
+        set_timer_options(args, timer)
+        labeled_timers.append((timer.name or name, timer))
+    for duration_str in durations:
+        timer = STimer()
+        set_timer_options(args, timer, duration_str)
+        # Labelled by --name when given, like the daemon labels timers.
+        labeled_timers.append((timer.name or duration_str, timer))
+    return labeled_timers
+
+
+def output_options(args):
+    # Logs and pipes get sparse JSON lines instead of terminal redraws.
+    options = {"stream_interval": args.interval, "stats": args.stats}
+    if args.precise:
+        options["precise"] = True
+    if args.json or not sys.stdout.isatty():
+        options["renderer"] = "json"
+    else:
+        options["renderer"] = None
+    return options
+
+
+def print_stats(outputs):
+    for output in outputs:
+        if output.label:
+            print(output.label.strip() + ":", file=sys.stderr)
+        print(output.stats.report(), file=sys.stderr)
+
+
+def worth_resuming(timer):
+    remaining = timer.snapshot().remaining
+    return remaining is None or remaining >= RESUME_MIN_REMAINING
+
+
+def resume_timers():
+    orphans = get_orphaned_timers("terminal")
+    labeled_timers = []
+    for entry in orphans:
+        timer = resume_running(entry)
+        if timer is None:
+            continue
+        label = entry["label"] or timer.duration(TimeFormat.CLOCK) or "stopwatch"
+        if timer.snapshot().expired:
+            print("Timer " + label + " expired while stimer was not running.")
+        else:
+            labeled_timers.append((label, timer))
+    clear_running([entry["id"] for entry in orphans])
+    return labeled_timers
+
+
 def parse(args):
-    timer = None
-    if args.list:
-        list_timers()
+    timers = []
+    if args.list is not None:
+        list_timers(args)
+        sys.exit(0)
+    elif args.import_file is not None:
+        import_file(args.import_file, args.overwrite)
+        sys.exit(0)
+    elif args.export is not None:
+        export_file(args.export)
         sys.exit(0)
     elif args.remove:
         removed = remove_timer(args.remove)
@@ -171,28 +413,111 @@ def parse(args):
         else:
             print("Timer " + args.remove + " not found.")
         sys.exit(0)
-    elif args.timer:
-        timer = load_timer(args.timer)
+    elif (
+        args.daemon
+        or args.stop_daemon
+        or args.jobs
+        or args.attach is not None
+        or args.cancel is not None
+    ):
+        daemon_command(args)
+        sys.exit(0)
+    for name in args.timer or []:
+        timer = load_timer(name)
         if timer is None:
-            print("Timer {} not found.".format(args.timer))
+            print("Timer {} not found.".format(name))
             sys.exit(0)
+        timers.append((name, timer))
 
-    if timer is None:
-        timer = STimer()
-    set_timer_options(args, timer)
+    if args.resume:
+        labeled_timers = resume_timers()
+        if not labeled_timers:
+            print("No timers to resume.")
+            sys.exit(0)
+    else:
+        labeled_timers = build_timers(args, timers, args.duration)
+    if len(labeled_timers) > 1 and (args.save or args.save_only or args.name):
+        print("Only one timer can be named or saved at a time.")
+        sys.exit(0)
+    if args.laps is not None and (len(labeled_timers) > 1 or args.background):
+        print("Laps can only be recorded for one timer in the foreground.")
+        sys.exit(0)
+    if args.laps is not None:
+        timer = labeled_timers[0][1]
+        up = timer.up if timer.up is not None else get_defaults()["up"]
+        if not up:
+            print('Laps can only be recorded in "UP" (stopwatch) mode. Use -u.')
+            sys.exit(0)
 
     if args.save or args.save_only:
-        timer_name = save_timer(timer)
+        timer_name = save_timer(labeled_timers[0][1])
         if timer_name:
             print("Timer saved as: " + timer_name)
         else:
             sys.exit(0)
         if args.save_only:
             sys.exit(0)
+    # Outside any batch, so the forked daemon does not inherit the config lock.
+    if args.background:
+        start_background(labeled_timers)
+        return
+    with config_batch():
+        if len(labeled_timers) > 1:
+            from .engine import STimerEngine
 
-    timer.start()
-    timer_output = STimerOutput(timer)
-    timer_output.start_output()
+            options = output_options(args)
+            engine = STimerEngine(stream=options["renderer"] == "json")
+            for label, timer in labeled_timers:
+                engine.add(
+                    timer,
+                    label=label,
+                    stream_interval=args.interval,
+                    stats=args.stats,
+                    precise=options.get("precise"),
+                )
+        else:
+            # Imported here to keep stimer.output and the renderer off the
+            # startup path of commands that never render.
+            from .output import STimerOutput
+
+            timer = labeled_timers[0][1]
+            timer_output = STimerOutput(timer, **output_options(args))
+            if args.laps is not None:
+                try:
+                    timer.record_laps(args.laps or None)
+                except OSError as e:
+                    print("Lap file could not be opened: " + str(e))
+                    sys.exit(0)
+
+    for label, timer in labeled_timers:
+        if timer.started() is False:
+            timer.start()
+    # Recorded so "stimer --resume" can pick them up if this process dies.
+    # Timers about to expire are not worth the two writes to running.json.
+    entry_ids = record_running(
+        [(label, timer) for label, timer in labeled_timers if worth_resuming(timer)]
+    )
+    lap_reader = None
+    try:
+        if len(labeled_timers) > 1:
+            if not engine.stream:
+                print("Timers started:")
+            engine.run()
+        else:
+            if args.laps is not None:
+                from .laps import LapReader
+
+                lap_reader = LapReader(timer)
+                lap_reader.start()
+            timer_output.start_output()
+    finally:
+        clear_running(entry_ids)
+        if lap_reader is not None:
+            lap_reader.stop()
+            timer.laps.close()
+            print(timer.laps.summary(), file=sys.stderr)
+        if args.stats:
+            print_stats(engine.outputs if len(labeled_timers) > 1 else [timer_output])
 
 
 def main():
@@ -200,11 +525,11 @@ def main():
         return argparse.RawTextHelpFormatter(prog, max_help_position=26)
 
     parser = argparse.ArgumentParser(
-        usage="%(prog)s [OPTIONS]... DURATION",
+        usage="%(prog)s [OPTIONS]... [DURATION]...",
         formatter_class=help_formatter,
     )
     parser.add_argument(
-        "duration", nargs="?", help=HELP_MSGS["duration"], metavar="DURATION"
+        "duration", nargs="*", help=HELP_MSGS["duration"], metavar="DURATION"
     )
     up = parser.add_mutually_exclusive_group()
     up.add_argument("-u", "--up", action="store_true", help=HELP_MSGS["up"])
@@ -226,9 +551,46 @@ def main():
         "-S", "--save-only", action="store_true", help=HELP_MSGS["save_only"]
     )
     save.add_argument("-r", "--remove", help=HELP_MSGS["remove"], metavar="NAME")
-    save.add_argument("-l", "--list", action="store_true", help=HELP_MSGS["list"])
+    save.add_argument(
+        "-l", "--list", nargs="?", const="", help=HELP_MSGS["list"], metavar="PATTERN"
+    )
+    save.add_argument(
+        "--import", dest="import_file", help=HELP_MSGS["import"], metavar="FILE"
+    )
+    save.add_argument(
+        "--export", nargs="?", const="-", help=HELP_MSGS["export"], metavar="FILE"
+    )
+    parser.add_argument("--overwrite", action="store_true", help=HELP_MSGS["overwrite"])
+    parser.add_argument(
+        "--sort", choices=sorted(SORT_KEYS), help=HELP_MSGS["sort"], metavar="KEY"
+    )
+    parser.add_argument("--reverse", action="store_true", help=HELP_MSGS["reverse"])
+    parser.add_argument("--limit", type=int, help=HELP_MSGS["limit"], metavar="N")
     parser.add_argument("-n", "--name", help=HELP_MSGS["name"])
-    parser.add_argument("-t", "--timer", help=HELP_MSGS["timer"], metavar="NAME")
+    parser.add_argument(
+        "-t", "--timer", action="append", help=HELP_MSGS["timer"], metavar="NAME"
+    )
+    parser.add_argument(
+        "-b", "--background", action="store_true", help=HELP_MSGS["background"]
+    )
+    daemon = parser.add_mutually_exclusive_group()
+    daemon.add_argument("-j", "--jobs", action="store_true", help=HELP_MSGS["jobs"])
+    daemon.add_argument("--attach", type=int, help=HELP_MSGS["attach"], metavar="ID")
+    daemon.add_argument("--cancel", type=int, help=HELP_MSGS["cancel"], metavar="ID")
+    daemon.add_argument("--daemon", action="store_true", help=HELP_MSGS["daemon"])
+    daemon.add_argument(
+        "--stop-daemon", action="store_true", help=HELP_MSGS["stop_daemon"]
+    )
+    parser.add_argument("--resume", action="store_true", help=HELP_MSGS["resume"])
+    parser.add_argument("--json", action="store_true", help=HELP_MSGS["json"])
+    parser.add_argument(
+        "--interval", type=float, help=HELP_MSGS["interval"], metavar="SECONDS"
+    )
+    parser.add_argument("--stats", action="store_true", help=HELP_MSGS["stats"])
+    parser.add_argument("--precise", action="store_true", help=HELP_MSGS["precise"])
+    parser.add_argument(
+        "--laps", nargs="?", const="", help=HELP_MSGS["laps"], metavar="FILE"
+    )
     parser.add_argument("--version", action="store_true", help=HELP_MSGS["version"])
     parser.add_argument("--help-duration", action="store_true", help=argparse.SUPPRESS)
     parser.add_argument("--debug", action="store_true", help=argparse.SUPPRESS)
@@ -245,10 +607,26 @@ def main():
         print("stimer " + VERSION)
         sys.exit(0)
 
+    if args.limit is not None and args.limit < 0:
+        print("Limit must not be negative.")
+        sys.exit(0)
+    if args.interval is not None and args.interval <= 0:
+        print("Interval must be a positive number of seconds.")
+        sys.exit(0)
+
     try:
         parse(args)
     except KeyboardInterrupt:
         sys.exit(0)
+    except TimeoutError as e:
+        logging.critical(e)
+        sys.exit(1)
+    except BrokenPipeError:
+        # The reader went away, as with "stimer --json | head". Point stdout at
+        # devnull so the interpreter's final flush does not raise again.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
     sys.exit(0)
 
 
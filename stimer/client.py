@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import socket
+
+from .confighandler import CONFIG_DIR
+
+SOCKET_FILENAME = "stimer.sock"
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, SOCKET_FILENAME)
+    return CONFIG_DIR + SOCKET_FILENAME
+
+
+class DaemonClient:
+    # Blocking client for the stimer daemon. Each request is one JSON object
+    # on one line and is answered the same way, so a command costs a connect
+    # and a round trip and never touches the config file.
+    def __init__(self, socket_path=None, timeout=5.0):
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+
+    def request(self, cmd, **params):
+        params["cmd"] = cmd
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(json.dumps(params).encode() + b"\n")
+                data = b""
+                while not data.endswith(b"\n"):
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        break
+                    data = data + chunk
+        except OSError as e:
+            logging.debug("stimer daemon not reachable: " + str(e))
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            logging.error("Invalid response from stimer daemon.")
+            return None
+
+    def running(self):
+        return self.request("ping") is not None
+
+    def start(self, timer, label=None):
+        return self.request("start", timer=timer.to_json(), label=label)
+
+    def list(self):
+        return self.request("list")
+
+    def get(self, timer_id):
+        return self.request("get", id=timer_id)
+
+    def cancel(self, timer_id):
+        return self.request("cancel", id=timer_id)
+
+    def shutdown(self):
+        return self.request("shutdown")
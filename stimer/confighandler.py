@@ -1,110 +1,560 @@
 import configparser
+import contextlib
+import fnmatch
+import heapq
+import io
 import json
 import logging
+import os
+import threading
+import time
 
 from pathlib import Path
 from .core import STimer
+from .timerstore import SQLITE_AVAILABLE, SQLiteTimerStore
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on this platform; writes stay atomic but unserialized.
+    fcntl = None
 
 CONFIG_DIR = str(Path.home()) + "/.config/stimer/"
 CONFIG_FILENAME = "stimer.conf"
 CONFIG_FILE = Path(CONFIG_DIR + CONFIG_FILENAME)
+TIMERS_DB_FILENAME = "timers.db"
+RUNNING_FILENAME = "running.json"
+LOCK_SUFFIX = ".lock"
+# Longest wait in seconds for another stimer process to release a lock.
+LOCK_TIMEOUT = 10.0
 CONFIG_SECTIONS = {
     "global": "GLOBAL",
     "timers": "TIMERS",
+    "state": "STATE",
 }
+# Key of the auto-name counter kept by each timer store.
+TIMER_NUMBERS_KEY = "timer_numbers"
 DEFAULTS = {
     "up": False,
     "sound": True,
     "widget_fmt": "full",
     "precision": 0,
+    "max_fps": 30,
+    "renderer": "native",
+    "stream_interval": 10,
+    "precise_expiry": False,
 }
 
+# Parsed config shared by all calls in this process, keyed on the file's
+# (mtime, size, inode) so edits from other processes are picked up. "text" is
+# the file content the cached config was read from or last written as.
+_config_cache = {"key": None, "config": None, "text": None}
+# Writes made inside config_batch() are held until the outermost batch exits.
+_config_batch = {"depth": 0, "dirty": False}
+# Open SQLite timer stores, keyed on database path.
+_timer_stores = {}
+# Locks held by this thread, keyed on lock file path.
+_held_locks = threading.local()
+
+
+@contextlib.contextmanager
+def file_lock(path, exclusive=True, timeout=None):
+    # Advisory flock on a lock file next to path, since path itself is
+    # replaced on every write. Re-entrant within a thread; a thread holding
+    # the exclusive lock also passes shared requests. Raises TimeoutError when
+    # another process holds the lock for longer than timeout.
+    lock_path = str(path) + LOCK_SUFFIX
+    held = getattr(_held_locks, "locks", None)
+    if held is None:
+        held = _held_locks.locks = {}
+    if fcntl is None or lock_path in held:
+        yield
+        return
+    try:
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError as e:
+        logging.debug("No lock for " + str(path) + ": " + str(e))
+        yield
+        return
+    try:
+        _acquire(fd, exclusive, LOCK_TIMEOUT if timeout is None else timeout, path)
+        held[lock_path] = fd
+        try:
+            yield
+        finally:
+            del held[lock_path]
+    finally:
+        # Closing the file releases the lock.
+        os.close(fd)
+
+
+def release_locks_after_fork():
+    # A forked child shares the parent's open lock files, and with them the
+    # locks, for as long as it keeps them open. Closing its copies leaves the
+    # parent's locks alone.
+    held = getattr(_held_locks, "locks", None) or {}
+    for fd in held.values():
+        with contextlib.suppress(OSError):
+            os.close(fd)
+    _held_locks.locks = {}
+    _config_batch["depth"] = 0
+    _config_batch["dirty"] = False
+
+
+def _acquire(fd, exclusive, timeout, path):
+    operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            pass
+        if time.monotonic() >= deadline:
+            raise TimeoutError(
+                "{} is locked by another stimer process.".format(Path(path).name)
+            )
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+
+@contextlib.contextmanager
+def config_batch():
+    # Holds the config lock throughout, so the batch reads and writes the
+    # config as one step against other stimer processes.
+    with file_lock(CONFIG_FILE):
+        if _config_batch["depth"] == 0:
+            # Another process may have written since the cache was filled.
+            _load_config_file()
+        _config_batch["depth"] = _config_batch["depth"] + 1
+        try:
+            yield
+        finally:
+            _config_batch["depth"] = _config_batch["depth"] - 1
+            if _config_batch["depth"] == 0 and _config_batch["dirty"]:
+                _config_batch["dirty"] = False
+                _write_config_file(_config_cache["config"])
+
 
 def get_defaults():
     config = _load_config_file()
-    defaults = {}
+    global_section = {}
     if CONFIG_SECTIONS["global"] in config:
         global_section = config[CONFIG_SECTIONS["global"]]
-        for key in DEFAULTS:
-            if key not in global_section:
-                key_json = json.dumps(DEFAULTS[key])
-                global_section[key] = key_json
-            defaults[key] = json.loads(global_section[key])
-    else:
-        config[CONFIG_SECTIONS["global"]] = {}
-        global_section = config[CONFIG_SECTIONS["global"]]
-        for key in DEFAULTS:
-            key_json = json.dumps(DEFAULTS[key])
-            global_section[key] = key_json
-        defaults = DEFAULTS
-    _write_config_file(config)
-    return defaults
+    if any(key not in global_section for key in DEFAULTS):
+        # Missing defaults are filled in under the lock, from a fresh read.
+        with config_batch():
+            config = _load_config_file()
+            if CONFIG_SECTIONS["global"] not in config:
+                config[CONFIG_SECTIONS["global"]] = {}
+            global_section = config[CONFIG_SECTIONS["global"]]
+            for key in DEFAULTS:
+                if key not in global_section:
+                    global_section[key] = json.dumps(DEFAULTS[key])
+            _write_config_file(config)
+    return {key: json.loads(global_section[key]) for key in DEFAULTS}
+
+
+class ConfigTimerStore:
+    # Saved timers kept as JSON values in the TIMERS section of stimer.conf.
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return len(self._section())
+
+    def _section(self):
+        config = _load_config_file()
+        if CONFIG_SECTIONS["timers"] in config:
+            return config[CONFIG_SECTIONS["timers"]]
+        return {}
+
+    def get(self, name):
+        return read_value(name, CONFIG_SECTIONS["timers"])
+
+    def items(self, pattern=None):
+        config = _load_config_file()
+        if CONFIG_SECTIONS["timers"] not in config:
+            return []
+        # Raw values skip an interpolation pass per timer.
+        items = config.items(CONFIG_SECTIONS["timers"], raw=True)
+        if pattern is None:
+            return items
+        return [item for item in items if fnmatch.fnmatchcase(item[0], pattern)]
+
+    def names(self):
+        return list(self._section().keys())
+
+    def put(self, name, timer_json):
+        write_value(name, timer_json, CONFIG_SECTIONS["timers"])
+
+    def put_many(self, items, meta=None):
+        with config_batch():
+            for name, timer_json in items:
+                self.put(name, timer_json)
+            for key, value in (meta or {}).items():
+                write_value(key, value, CONFIG_SECTIONS["state"])
+
+    def get_meta(self, key):
+        return read_value(key, CONFIG_SECTIONS["state"])
+
+    def put_meta(self, key, value):
+        write_value(key, value, CONFIG_SECTIONS["state"])
+
+    def remove(self, name):
+        with config_batch():
+            config = _load_config_file()
+            if CONFIG_SECTIONS["timers"] in config:
+                if name in config[CONFIG_SECTIONS["timers"]]:
+                    config[CONFIG_SECTIONS["timers"]].pop(name)
+                    _write_config_file(config)
+                    return True
+        return False
+
+
+_config_timer_store = ConfigTimerStore()
+
+
+def _timer_store():
+    backend = read_value("timer_store") or '"config"'
+    try:
+        backend = json.loads(backend)
+    except ValueError:
+        pass
+    if backend == "sqlite" and SQLITE_AVAILABLE:
+        path = Path(CONFIG_DIR + TIMERS_DB_FILENAME)
+        store = _timer_stores.get(path)
+        if store is None:
+            store = _timer_stores[path] = SQLiteTimerStore(path)
+            _migrate_config_timers(store)
+        return store
+    if backend == "sqlite":
+        logging.warning("sqlite3 is not available, saved timers stay in config.")
+    elif backend != "config":
+        logging.warning("Unknown timer_store " + repr(backend) + ", using config.")
+    return _config_timer_store
+
+
+def _migrate_config_timers(store):
+    # One-time move of timers saved in stimer.conf into a newly enabled store.
+    with config_batch():
+        config = _load_config_file()
+        if CONFIG_SECTIONS["timers"] not in config:
+            return
+        items = list(config[CONFIG_SECTIONS["timers"]].items())
+        store.put_many(items)
+        config.remove_section(CONFIG_SECTIONS["timers"])
+        _write_config_file(config)
+    logging.info(
+        "Moved {} saved timers from {} to {}.".format(
+            len(items), CONFIG_FILENAME, store.path.name
+        )
+    )
 
 
 def save_timer(timer):
     timer_json = timer.to_json()
-    name = None
-    if timer.name:
-        name = timer.name
-        timers = get_timers_list()
-        for timer in timers:
-            if timer[0] == name:
-                overwrite = input(
-                    "Timer {} already exists. Overwrite?(Y/n)".format(name)
-                )
-                if overwrite != "Y":
-                    return None
-    else:
-        name = _find_timer_number()
-    write_value(name, timer_json, CONFIG_SECTIONS["timers"])
+    name = timer.name
+    if name and not valid_timer_name(name):
+        logging.error(
+            'Timer name "' + name + '" cannot contain "=", ":" or line breaks, '
+            "or start or end with a space."
+        )
+        return None
+    overwrite = False
+    # Asked before locking, so other stimer processes are not held up while
+    # the prompt waits for an answer.
+    if name and name in _timer_store():
+        answer = input("Timer {} already exists. Overwrite?(Y/n)".format(name))
+        if answer != "Y":
+            return None
+        overwrite = True
+    # Locked so no other process takes the name between the check and the put.
+    with config_batch():
+        store = _timer_store()
+        if not name:
+            name = _find_timer_number(store)
+        elif not overwrite and name in store:
+            logging.error("Timer " + name + " was just saved by another process.")
+            return None
+        store.put(name, timer_json)
     return name
 
 
 def remove_timer(name):
-    config = _load_config_file()
-    if CONFIG_SECTIONS["timers"] in config:
-        if name in config[CONFIG_SECTIONS["timers"]]:
-            config[CONFIG_SECTIONS["timers"]].pop(name)
-            _write_config_file(config)
-            logging.info("Timer " + name + " removed.")
-            return True
-    return False
+    with config_batch():
+        store = _timer_store()
+        if not store.remove(name):
+            return False
+        _release_timer_number(store, name)
+    logging.info("Timer " + name + " removed.")
+    return True
 
 
 def load_timer(name):
-    timer_json = read_value(name, CONFIG_SECTIONS["timers"])
+    timer_json = _timer_store().get(name)
     if timer_json is None:
         return None
     return STimer.from_json(timer_json)
 
 
 def get_timers_list():
-    config = _load_config_file()
-    timers = []
-    if CONFIG_SECTIONS["timers"] in config:
-        timers_section = config[CONFIG_SECTIONS["timers"]]
-        for name in timers_section:
-            timer = load_timer(name)
-            if timer:
-                timers.append([name, timer])
-    return timers
+    return [[name, timer] for name, timer in iter_timers()]
 
 
-def _find_timer_number():
-    config = _load_config_file()
-    if CONFIG_SECTIONS["timers"] not in config:
-        config.add_section(CONFIG_SECTIONS["timers"])
-    names = config[CONFIG_SECTIONS["timers"]].keys()
-    name_nums = []
-    for name in names:
-        if name.isdigit():
-            name_nums.append(int(name))
-    name_nums.sort()
-    new_num = 1
-    for num in name_nums:
-        if new_num == num:
-            new_num = new_num + 1
-    return str(new_num)
+def iter_timers(match=None):
+    # Saved timers one at a time in saved order. match is a name prefix, or a
+    # glob if it has any of "*?[", and is left to the store to apply.
+    pattern = None
+    if match:
+        pattern = match.lower()
+        if not any(char in pattern for char in "*?["):
+            pattern = pattern + "*"
+    for name, timer_json in _timer_store().items(pattern):
+        timer = STimer.from_json(timer_json)
+        if timer:
+            yield name, timer
+
+
+def export_timers(f):
+    # One JSON line per saved timer, in STimer.to_json form with the name it
+    # is saved under.
+    count = 0
+    for name, timer_json in _timer_store().items():
+        try:
+            data = json.loads(timer_json)
+        except ValueError:
+            logging.warning("Saved timer " + name + " could not be decoded.")
+            continue
+        data["name"] = name
+        f.write(json.dumps(data) + "\n")
+        count = count + 1
+    return count
+
+
+def import_timers(lines, overwrite=False):
+    # Reads the saved timers once and writes every imported timer in one go.
+    # Names that are already taken are skipped, or replaced with overwrite.
+    # Timers without a name are numbered like save_timer numbers them.
+    counts = {"imported": 0, "overwritten": 0, "skipped": 0, "invalid": 0}
+    with config_batch():
+        store = _timer_store()
+        names = {name.lower() for name in store.names()}
+        items = {}
+        unnamed = []
+        for line_num, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            timer = _import_timer(line)
+            if timer is None:
+                logging.warning("Line " + str(line_num) + " is not a valid timer.")
+                counts["invalid"] = counts["invalid"] + 1
+                continue
+            if not timer.name:
+                unnamed.append(timer)
+                continue
+            key = timer.name.lower()
+            if key in names or key in items:
+                if not overwrite:
+                    counts["skipped"] = counts["skipped"] + 1
+                    continue
+                counts["overwritten"] = counts["overwritten"] + 1
+            items[key] = (timer.name, timer.to_json())
+        meta = {}
+        if unnamed:
+            # Numbered in memory; the counter goes out with the timers.
+            state = _timer_numbers(store)
+            changed = False
+            for timer in unnamed:
+                name, allocated = _allocate_timer_number(state, store, items)
+                changed = changed or allocated
+                items[name] = (name, timer.to_json())
+            if changed:
+                meta[TIMER_NUMBERS_KEY] = json.dumps(state)
+        store.put_many(items.values(), meta)
+    counts["imported"] = len(items)
+    return counts
+
+
+_TIMER_KEYS = frozenset(STimer().option_dict)
+
+
+def _import_timer(line):
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not _TIMER_KEYS.issuperset(data):
+        return None
+    duration = data.get("duration")
+    if duration is not None:
+        if isinstance(duration, bool) or not isinstance(duration, (int, float)):
+            return None
+        if not duration > 0:
+            return None
+    for key in ("up", "sound"):
+        if data.get(key) not in (None, True, False):
+            return None
+    precision = data.get("precision")
+    if precision is not None:
+        if isinstance(precision, bool) or not isinstance(precision, int):
+            return None
+        if precision < 0:
+            return None
+    if data.get("widget_fmt") not in (None, "simple", "full"):
+        return None
+    name = data.get("name")
+    if name is not None:
+        if not isinstance(name, str) or not valid_timer_name(name):
+            return None
+    return STimer(**data)
+
+
+def valid_timer_name(name):
+    # configparser cannot read these back as keys.
+    if name != name.strip():
+        return False
+    return not any(char in name for char in "=:\r\n")
+
+
+def _find_timer_number(store=None, taken=()):
+    # Lowest number not used as a name. The store keeps a counter that only
+    # moves past names in use and a heap of numbers freed below it, so this
+    # costs a few name lookups however many timers are saved. Both are hints:
+    # every candidate is checked against the store, which keeps them right
+    # when numeric names come from --name, imports or manual edits.
+    if store is None:
+        store = _timer_store()
+    state = _timer_numbers(store)
+    name, changed = _allocate_timer_number(state, store, taken)
+    if changed:
+        store.put_meta(TIMER_NUMBERS_KEY, json.dumps(state))
+    return name
+
+
+def _allocate_timer_number(state, store, taken):
+    free = state["free"]
+    changed = False
+    while free and (free[0] >= state["next"] or _number_taken(free[0], store, taken)):
+        heapq.heappop(free)
+        changed = True
+    if free:
+        return str(free[0]), changed
+    while _number_taken(state["next"], store, taken):
+        state["next"] = state["next"] + 1
+        changed = True
+    return str(state["next"]), changed
+
+
+def _number_taken(num, store, taken):
+    return str(num) in taken or str(num) in store
+
+
+def _release_timer_number(store, name):
+    if not (name.isascii() and name.isdigit()):
+        return
+    state = _timer_numbers(store)
+    if int(name) < state["next"]:
+        heapq.heappush(state["free"], int(name))
+        store.put_meta(TIMER_NUMBERS_KEY, json.dumps(state))
+
+
+def _timer_numbers(store):
+    state = None
+    try:
+        state = json.loads(store.get_meta(TIMER_NUMBERS_KEY) or "null")
+    except ValueError:
+        pass
+    if not isinstance(state, dict):
+        # Counting up from 1 walks past the saved numbers once.
+        state = {"next": 1, "free": []}
+    return state
+
+
+def get_running_timers():
+    path = CONFIG_DIR + RUNNING_FILENAME
+    try:
+        with file_lock(path, exclusive=False), open(path) as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        logging.warning(RUNNING_FILENAME + " could not be read: " + str(e))
+        return []
+    return entries
+
+
+def get_orphaned_timers(owner):
+    # Timers recorded by processes that are gone, i.e. ones that crashed or
+    # were killed with their terminal.
+    orphans = []
+    for entry in get_running_timers():
+        if entry["owner"] != owner or entry["pid"] == os.getpid():
+            continue
+        try:
+            os.kill(entry["pid"], 0)
+        except ProcessLookupError:
+            orphans.append(entry)
+        except OSError:
+            pass
+    return orphans
+
+
+def running_entry(label, timer, owner="terminal"):
+    # Running timers are kept by wall-clock start time since the monotonic
+    # clock restarts with the host.
+    return {
+        "id": os.urandom(6).hex(),
+        "label": label,
+        "owner": owner,
+        "pid": os.getpid(),
+        "started_at_ns": time.time_ns() - timer.elapsed_ns(),
+        "timer": timer.to_json(),
+    }
+
+
+def update_running(add=(), remove=()):
+    # The file is only written when timers start or stop, never while they
+    # run, and any number of changes go out in one write.
+    remove = set(remove)
+    path = Path(CONFIG_DIR + RUNNING_FILENAME)
+    try:
+        with file_lock(path):
+            entries = get_running_timers()
+            kept = [entry for entry in entries if entry["id"] not in remove]
+            if not add and len(kept) == len(entries):
+                return True
+            entries = kept + list(add)
+            if entries:
+                _replace_file(path, json.dumps(entries, indent=1))
+            elif path.exists():
+                path.unlink()
+    except OSError as e:
+        # Includes TimeoutError from a lock that was never released.
+        logging.error(e)
+        return False
+    return True
+
+
+def record_running(labeled_timers, owner="terminal"):
+    entries = [running_entry(label, timer, owner) for label, timer in labeled_timers]
+    if not update_running(add=entries):
+        return []
+    return [entry["id"] for entry in entries]
+
+
+def clear_running(entry_ids):
+    if entry_ids:
+        update_running(remove=entry_ids)
+
+
+def resume_running(entry):
+    timer = STimer.from_json(entry["timer"])
+    if timer is not None:
+        timer.start(max(time.time_ns() - entry["started_at_ns"], 0))
+    return timer
 
 
 def read_value(key: str, section: str = CONFIG_SECTIONS["global"]) -> str:
@@ -117,36 +567,109 @@ def read_value(key: str, section: str = CONFIG_SECTIONS["global"]) -> str:
 
 
 def write_value(key: str, value: str, section: str = CONFIG_SECTIONS["global"]):
-    config = _load_config_file()
-    if section not in config:
-        config[section] = {}
-    config[section][key] = value
-    _write_config_file(config)
+    with config_batch():
+        config = _load_config_file()
+        if section not in config:
+            config[section] = {}
+        config[section][key] = value
+        _write_config_file(config)
+
+
+def _config_key():
+    try:
+        stat = CONFIG_FILE.stat()
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
 
 
 def _load_config_file() -> configparser.ConfigParser:
+    if _config_batch["depth"] and _config_cache["config"] is not None:
+        return _config_cache["config"]
+    key = _config_key()
+    if key is not None and key == _config_cache["key"]:
+        return _config_cache["config"]
     config = configparser.ConfigParser()
+    text = ""
     try:
-        if not CONFIG_FILE.exists():
-            Path(CONFIG_DIR).mkdir(parents=True, exist_ok=True)
-            with open(CONFIG_FILE, "x"):
-                logging.info(CONFIG_FILE.name + " file created.")
-        else:
-            with open(CONFIG_FILE, "r") as f:
-                config.read_file(f)
+        if key is not None:
+            with file_lock(CONFIG_FILE, exclusive=False):
+                key = _config_key()
+                with open(CONFIG_FILE, "r") as f:
+                    text = f.read()
+            config.read_string(text)
+    except FileNotFoundError:
+        key = None
+    except TimeoutError:
+        # A lock that is never released is fatal, not an unreadable file.
+        raise
     except OSError as e:
         logging.error(e)
         return None
+    _config_cache["key"] = key
+    _config_cache["config"] = config
+    _config_cache["text"] = text
     return config
 
 
 def _write_config_file(config: configparser.ConfigParser) -> configparser.ConfigParser:
+    _config_cache["config"] = config
+    if _config_batch["depth"]:
+        _config_batch["dirty"] = True
+        return config
+    buffer = io.StringIO()
+    config.write(buffer)
+    text = buffer.getvalue()
+    key = _config_key()
+    if (
+        key is not None
+        and key == _config_cache["key"]
+        and text == _config_cache["text"]
+    ):
+        logging.debug(CONFIG_FILE.name + " unchanged, not written.")
+        return config
     try:
-        if not CONFIG_FILE.exists():
-            Path(CONFIG_DIR).mkdir(parents=True, exist_ok=True)
-        with open(CONFIG_FILE, "w") as f:
-            config.write(f)
+        _replace_file(CONFIG_FILE, text)
     except OSError as e:
         logging.error(e)
+        _config_cache["key"] = None
         return None
+    _config_cache["key"] = _config_key()
+    _config_cache["text"] = text
     return config
+
+
+def _replace_file(path: Path, text: str):
+    # Write a temp file next to path and rename it over path, so readers see
+    # either the old or the new content and never a partial file. A symlinked
+    # path keeps its link; the file it points to is the one replaced.
+    path = path.resolve()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        tmp_path = str(
+            path.parent / ".{}.{}.tmp".format(path.name, os.urandom(4).hex())
+        )
+        try:
+            # Created like open() would, so new files follow the umask.
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        with contextlib.suppress(FileNotFoundError):
+            os.chmod(tmp_path, path.stat().st_mode & 0o7777)
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+    with contextlib.suppress(OSError):
+        dir_fd = os.open(str(path.parent), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -1,11 +1,61 @@
-import re
 import sys
 import json
+import importlib.util
 import logging
+import math
 import time
 from enum import Enum
 
 
+NS_PER_SEC = 1000000000
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+
+
+class MonotonicClock:
+    def now_ns(self):
+        return time.monotonic_ns()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def sleep_until_ns(self, deadline_ns, spin_ns=0):
+        # Sleeps to spin_ns short of the deadline, then spins on the clock:
+        # time.sleep() can wake a scheduler quantum late, spinning cannot.
+        sleep_ns = deadline_ns - time.monotonic_ns() - spin_ns
+        if sleep_ns > 0:
+            time.sleep(sleep_ns / NS_PER_SEC)
+        now_ns = time.monotonic_ns()
+        while now_ns < deadline_ns:
+            now_ns = time.monotonic_ns()
+        return now_ns
+
+
+class ManualClock:
+    # Virtual clock that only moves when advanced; sleeping advances it
+    # instantly so long timers can be driven in tests and benchmarks.
+    def __init__(self, start_ns=0):
+        self._now_ns = start_ns
+
+    def now_ns(self):
+        return self._now_ns
+
+    def advance(self, seconds):
+        self.advance_ns(round(seconds * NS_PER_SEC))
+
+    def advance_ns(self, ns):
+        self._now_ns = self._now_ns + int(ns)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance(seconds)
+
+    def sleep_until_ns(self, deadline_ns, spin_ns=0):
+        if deadline_ns > self._now_ns:
+            self._now_ns = deadline_ns
+        return self._now_ns
+
+
 class TimeFormat(Enum):
     SECONDS = 0
     CLOCK = 1
@@ -27,107 +77,313 @@ class STimeData:
     def clock(self, precision=None):
         if precision is None:
             precision = 0
-        minutes = self._seconds / 60
-        hours_left = int(minutes / 60)
-        mins_left = int((self._seconds / 60) - (60 * hours_left))
-        secs_left = round(self._seconds % 60, precision)
-        if precision == 0:
-            secs_left = int(secs_left)
-        if secs_left == 60:
-            secs_left = 0
-            mins_left = mins_left + 1
-        if mins_left == 60:
-            mins_left = 0
-            hours_left = hours_left + 1
-        clock_format = []
-        clock_format.append(str(hours_left))
-        clock_format.append(str(mins_left))
-        if precision == 0:
-            clock_format.append(str(secs_left))
-        else:
-            clock_format.append(format(secs_left, "." + str(precision) + "f"))
-        clock_str = ""
-        for s in clock_format:
-            whole_split = s.split(".")[0]
-            if len(whole_split) < 2:
-                s = "0" + s
-            clock_str = clock_str + s + ":"
-        clock_str = clock_str[:-1]
+        ticks = _clock_ticks(self._seconds, precision)
+        cache = _CLOCK_CACHES.get(precision)
+        if cache is None:
+            cache = _CLOCK_CACHES[precision] = {}
+        clock_str = cache.get(ticks)
+        if clock_str is None:
+            if len(cache) >= _CLOCK_CACHE_SIZE:
+                cache.clear()
+            clock_str = cache[ticks] = _clock_str(ticks, precision)
         return clock_str
 
 
-def parse_duration(duration: str) -> float:
-    def to_float(decimal_time: str) -> float:
-        time = 0.0
-        splits = decimal_time.split(".")
-        if splits[0] != "":
-            time = time + float(splits[0])
-        if len(splits) > 1 and splits[1] != "":
-            new_time = "0." + splits[1]
-            time = time + float(new_time)
-        return time
+_TIE_THRESHOLD = 0.5 - 1e-6
+_CLOCK_CACHE_SIZE = 256
+_CLOCK_CACHES = {}
+# Below this many values the NumPy setup costs more than it saves.
+_NUMPY_MIN_BATCH = 64
+# Tick counts stay exact in a float64 below this.
+_NUMPY_MAX_TICKS = 2**52
 
-    if duration is None:
+
+def _clock_ticks(seconds, precision):
+    minutes = seconds / 60
+    hours_left = int(minutes / 60)
+    mins_left = int(minutes - (60 * hours_left))
+    scale = 10**precision
+    scaled_secs = (seconds % 60) * scale
+    secs_ticks = round(scaled_secs)
+    if abs(secs_ticks - scaled_secs) > _TIE_THRESHOLD:
+        # Too close to a rounding tie for the scaled float to be trusted;
+        # defer to round() on the unscaled value like the clock always has.
+        secs_ticks = round(round(seconds % 60, precision) * scale)
+    return ((hours_left * 60) + mins_left) * 60 * scale + secs_ticks
+
+
+def _clock_ticks_numpy(np, seconds, precision):
+    # The same float operations as _clock_ticks, one array at a time. Returns
+    # None when the values do not fit the float64 shortcut.
+    values = np.asarray(seconds, dtype=np.float64)
+    scale = 10**precision
+    if (
+        not np.isfinite(values).all()
+        or np.abs(values).max() * scale >= _NUMPY_MAX_TICKS
+    ):
         return None
+    minutes = values / 60
+    hours_left = np.trunc(minutes / 60)
+    mins_left = np.trunc(minutes - (60 * hours_left))
+    secs = np.remainder(values, 60)
+    scaled_secs = secs * scale
+    secs_ticks = np.rint(scaled_secs)
+    for i in np.flatnonzero(np.abs(secs_ticks - scaled_secs) > _TIE_THRESHOLD):
+        secs_ticks[i] = round(round(float(secs[i]), precision) * scale)
+    return (((hours_left * 60) + mins_left) * 60 * scale + secs_ticks).astype(np.int64)
+
+
+def clock_batch(seconds, precision=None):
+    # STimeData(value).clock(precision) for every value of a sequence or NumPy
+    # array, as a list. Each distinct clock is formatted once.
+    if precision is None:
+        precision = 0
+    if NUMPY_AVAILABLE and len(seconds) >= _NUMPY_MIN_BATCH:
+        import numpy
+
+        ticks = _clock_ticks_numpy(numpy, seconds, precision)
+        if ticks is not None:
+            unique, inverse = numpy.unique(ticks.ravel(), return_inverse=True)
+            clocks = numpy.array(
+                [_clock_str(tick, precision) for tick in unique.tolist()],
+                dtype=object,
+            )
+            return clocks[inverse.ravel()].tolist()
+    clocks = {}
+    result = []
+    for value in seconds:
+        ticks = _clock_ticks(value, precision)
+        clock_str = clocks.get(ticks)
+        if clock_str is None:
+            clock_str = clocks[ticks] = _clock_str(ticks, precision)
+        result.append(clock_str)
+    return result
+
+
+def _frac_template(precision):
+    return ".%0" + str(precision) + "d"
 
-    char_regex = r"(?i)(?=^[\d\.hms]*[hms][\d\.hms]*$)([\d\.[hms]*[hms][\d\.hms]*){1,3}"
-    clock_regex = r"^((?=((:)|(\d+)))(:?\d*\.?\d*){1,3})$"
-    char_pattern = re.compile(char_regex)
-    clock_pattern = re.compile(clock_regex)
-    char_match = re.match(char_pattern, duration)
-    clock_match = re.match(clock_pattern, duration)
+
+_FRAC_TEMPLATES = [_frac_template(precision) for precision in range(10)]
+_TWO_DIGITS = ["%02d" % number for number in range(100)]
+
+
+def _clock_str(ticks, precision):
+    # ticks counts units of 10^-precision seconds; carries into minutes and
+    # hours fall out of the divmods.
+    if precision == 0:
+        mins, secs = divmod(ticks, 60)
+        frac_str = ""
+    else:
+        secs, frac = divmod(ticks, 10**precision)
+        mins, secs = divmod(secs, 60)
+        if precision < len(_FRAC_TEMPLATES):
+            frac_str = _FRAC_TEMPLATES[precision] % frac
+        else:
+            frac_str = _frac_template(precision) % frac
+    hours, mins = divmod(mins, 60)
+    if hours < 100:
+        hours_str = _TWO_DIGITS[hours]
+    else:
+        hours_str = str(hours)
+    return hours_str + ":" + _TWO_DIGITS[mins] + ":" + _TWO_DIGITS[secs] + frac_str
+
+
+class DurationParseError(ValueError):
+    def __init__(self, message, duration, position):
+        super().__init__("{} at position {}".format(message, position))
+        self.duration = duration
+        self.position = position
+
+
+_HMS_UNITS = {"h": 0, "m": 1, "s": 2}
+_CLOCK_FIELDS = 3
+
+
+def _clock_field(text: str) -> float:
+    whole, dot, frac = text.partition(".")
+    time = 0.0
+    if whole != "":
+        time = time + float(whole)
+    if frac != "":
+        time = time + float("0." + frac)
+    return time
+
+
+def _scan_duration(duration: str) -> float:
+    # Single pass over the string: numbers are runs of digits with at most one
+    # ".", and the first separator decides between hms and clock format.
+    # Blank numbers count as 0.
+    fmt = None
+    hms = [None, None, []]
+    fields = []
+    start = 0
+    dot = None
+    for i, char in enumerate(duration):
+        if char.isdecimal():
+            continue
+        if char == ".":
+            if dot is not None:
+                raise DurationParseError("Unexpected '.'", duration, i)
+            dot = i
+            continue
+        if char == ":":
+            if fmt == "hms":
+                raise DurationParseError("Unexpected ':'", duration, i)
+            if len(fields) == _CLOCK_FIELDS - 1:
+                raise DurationParseError("Too many ':' fields", duration, i)
+            fmt = "clock"
+            fields.append(duration[start:i])
+        else:
+            unit = _HMS_UNITS.get(char.lower())
+            if unit is None:
+                raise DurationParseError(
+                    "Unexpected character {!r}".format(char), duration, i
+                )
+            if fmt == "clock":
+                raise DurationParseError("Unexpected unit", duration, i)
+            fmt = "hms"
+            text = duration[start:i]
+            value = float(text) if text not in ("", ".") else 0.0
+            if unit == 2:
+                hms[2].append(value)
+            else:
+                hms[unit] = (hms[unit] or 0.0) + value
+        start = i + 1
+        dot = None
 
     seconds = 0.0
-    if char_match:
-        logging.debug("Duration matched character format.")
-        hours_pattern = re.compile(r"(?i)\d*\.?\d*h")
-        mins_pattern = re.compile(r"(?i)\d*\.?\d*m")
-        secs_pattern = re.compile(r"(?i)((\d*\.?\d*s)|(\d*\.?\d*$))")
-        hours_match = re.findall(hours_pattern, duration)
-        mins_match = re.findall(mins_pattern, duration)
-        secs_match = re.findall(secs_pattern, duration)
-
-        if hours_match:
-            hours = 0.0
-            for match in hours_match:
-                hours = hours + float(match[:-1])
+    if fmt == "hms":
+        text = duration[start:]
+        if text not in ("", "."):
+            hms[2].append(float(text))
+        hours, mins, secs = hms
+        if hours is not None:
             seconds = seconds + (hours * 60 * 60)
-        if mins_match:
-            mins = 0.0
-            for match in mins_match:
-                mins = mins + float(match[:-1])
+        if mins is not None:
             seconds = seconds + (mins * 60)
-        if secs_match:
-            for match in secs_match:
-                first_group = match[0]
-                if len(first_group) > 0:
-                    if first_group[-1] == "s":
-                        first_group = first_group[:-1]
-                    seconds = seconds + float(first_group)
-    elif clock_match:
-        logging.debug("Duration matched clock format.")
-        duration_splits = duration.split(":")
-        duration_splits.reverse()
-        multiplier = 1
-        for split in duration_splits:
-            split = to_float(split)
-            seconds = seconds + (multiplier * split)
-            multiplier = multiplier * 60
-    else:
-        logging.debug("Duration did not match pattern.")
+        for sec in secs:
+            seconds = seconds + sec
+        return seconds
+
+    if duration == "":
+        raise DurationParseError("Empty duration", duration, 0)
+    if duration[0] == ".":
+        raise DurationParseError(
+            "Clock format must start with a digit or ':'", duration, 0
+        )
+    fields.append(duration[start:])
+    multiplier = 1
+    for field in reversed(fields):
+        seconds = seconds + (multiplier * _clock_field(field))
+        multiplier = multiplier * 60
+    return seconds
+
+
+def parse_duration(duration: str, strict: bool = False) -> float:
+    if duration is None:
+        return None
+    try:
+        seconds = _scan_duration(duration)
+    except DurationParseError as e:
+        if strict:
+            raise
+        logging.debug("Duration did not match pattern: " + str(e))
         return None
     return seconds
 
 
+class STimerSnapshot:
+    # Read-only view of a timer at one clock reading. Derived values are
+    # computed on first access and cached, so every field of a frame agrees.
+    __slots__ = (
+        "_elapsed_ns",
+        "_duration",
+        "_precision",
+        "_duration_precision",
+        "_elapsed",
+        "_remaining",
+        "_elapsed_clock",
+        "_remaining_clock",
+        "_duration_clock",
+    )
+
+    def __init__(self, elapsed_ns, duration, precision, duration_precision):
+        self._elapsed_ns = elapsed_ns
+        self._duration = duration
+        self._precision = precision
+        self._duration_precision = duration_precision
+        self._elapsed = None
+        self._remaining = None
+        self._elapsed_clock = None
+        self._remaining_clock = None
+        self._duration_clock = None
+
+    @property
+    def elapsed_ns(self):
+        return self._elapsed_ns
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @property
+    def precision(self):
+        return self._precision
+
+    @property
+    def elapsed(self):
+        if self._elapsed is None:
+            elapsed_time = self._elapsed_ns / NS_PER_SEC
+            if self._duration:
+                elapsed_time = min(elapsed_time, self._duration)
+            self._elapsed = elapsed_time
+        return self._elapsed
+
+    @property
+    def remaining(self):
+        if self._remaining is None and self._duration is not None:
+            self._remaining = self._duration - self.elapsed
+        return self._remaining
+
+    @property
+    def expired(self):
+        if self._duration is None:
+            return False
+        return self.elapsed >= self._duration
+
+    @property
+    def elapsed_clock(self):
+        if self._elapsed_clock is None:
+            self._elapsed_clock = STimeData(self.elapsed).clock(self._precision)
+        return self._elapsed_clock
+
+    @property
+    def remaining_clock(self):
+        if self._remaining_clock is None and self._duration is not None:
+            self._remaining_clock = STimeData(self.remaining).clock(self._precision)
+        return self._remaining_clock
+
+    @property
+    def duration_clock(self):
+        if self._duration_clock is None and self._duration is not None:
+            self._duration_clock = STimeData(self._duration).clock(
+                self._duration_precision
+            )
+        return self._duration_clock
+
+
 class STimer:
-    def __init__(self, **kwargs):
+    def __init__(self, clock=None, **kwargs):
+        self.clock = clock or MonotonicClock()
         self._duration = None
         self.up = None
         self.name = None
         self.sound = None
         self.widget_fmt = None
         self._precision = None
-        self._start_time = None
+        self._start_ns = None
+        self.laps = None
         self.option_dict = kwargs
 
     @classmethod
@@ -220,7 +476,7 @@ class STimer:
         if self.started() is False:
             elapsed_time = 0.0
         else:
-            elapsed_time = time.time() - self._start_time
+            elapsed_time = self.elapsed_ns() / NS_PER_SEC
             if self.duration():
                 elapsed_time = min(elapsed_time, self.duration())
         stime = STimeData(elapsed_time)
@@ -235,13 +491,42 @@ class STimer:
         stime = STimeData(secs_remaining)
         return stime(time_format, precision)
 
+    def snapshot(self):
+        return STimerSnapshot(
+            self.elapsed_ns(), self._duration, self.precision, self.duration_precision
+        )
+
+    def elapsed_ns(self):
+        if self._start_ns is None:
+            return 0
+        return self.clock.now_ns() - self._start_ns
+
+    def deadline_ns(self):
+        # First clock reading at which the timer counts as expired.
+        if self._start_ns is None or self._duration is None:
+            return None
+        return self._start_ns + math.ceil(self._duration * NS_PER_SEC)
+
+    def record_laps(self, path=None):
+        from .laps import LapRecorder
+
+        self.laps = LapRecorder(path)
+        return self.laps
+
+    def lap(self):
+        # Returns the time since the previous lap, or since the start.
+        if self.laps is None:
+            self.record_laps()
+        return self.laps.add(self.elapsed_ns())
+
     def started(self):
-        if self._start_time is None:
+        if self._start_ns is None:
             return False
         return True
 
-    def start(self):
-        self._start_time = time.time()
+    def start(self, elapsed_ns=0):
+        # elapsed_ns resumes a timer that has already been running elsewhere.
+        self._start_ns = self.clock.now_ns() - elapsed_ns
         if self.duration() is None:
             if self.up is None or self.up is False:
                 logging.critical(
@@ -251,3 +536,60 @@ class STimer:
         logging.debug(
             "STimer started with duration: " + (str(self.duration()) or "None")
         )
+
+    async def wait(self):
+        if self.started() is False:
+            raise RuntimeError('"STimer.start()" must be called before "wait()".')
+        if self._duration is None:
+            raise ValueError("A timer with no duration never expires.")
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        snap = self.snapshot()
+        # The loop clock and the timer clock can drift apart, so re-check.
+        while not snap.expired:
+            await _sleep_at(loop, loop.time() + snap.remaining)
+            snap = self.snapshot()
+        return snap
+
+    async def ticks(self, interval):
+        if self.started() is False:
+            raise RuntimeError('"STimer.start()" must be called before "ticks()".')
+        if interval <= 0:
+            raise ValueError("Tick interval must be positive.")
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        interval_ns = round(interval * NS_PER_SEC)
+        duration_ns = None
+        if self._duration is not None:
+            duration_ns = round(self._duration * NS_PER_SEC)
+        snap = self.snapshot()
+        yield snap
+        tick = snap.elapsed_ns // interval_ns
+        while not snap.expired:
+            # Ticks stay on the elapsed-time grid; late ones are skipped, not
+            # bunched up, and the last one lands on expiry.
+            tick = tick + 1
+            target_ns = tick * interval_ns
+            if duration_ns is not None and target_ns > duration_ns:
+                target_ns = duration_ns
+            delay_ns = target_ns - self.elapsed_ns()
+            if delay_ns > 0:
+                await _sleep_at(loop, loop.time() + delay_ns / NS_PER_SEC)
+            snap = self.snapshot()
+            tick = max(tick, snap.elapsed_ns // interval_ns)
+            yield snap
+
+
+def _sleep_at(loop, when):
+    # One timer handle and one future per wait; nothing runs until it is due.
+    future = loop.create_future()
+    handle = loop.call_at(when, _set_future_done, future)
+    future.add_done_callback(lambda future: handle.cancel())
+    return future
+
+
+def _set_future_done(future):
+    if not future.done():
+        future.set_result(None)
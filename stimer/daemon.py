@@ -0,0 +1,238 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from .client import DaemonClient, default_socket_path
+from .confighandler import (
+    get_orphaned_timers,
+    release_locks_after_fork,
+    resume_running,
+    running_entry,
+    update_running,
+)
+from .core import STimer, TimeFormat
+
+
+class STimerDaemon:
+    # Owns running timers for "stimer --background" so they outlive the
+    # terminal that started them. Clients talk to it over a Unix socket, one
+    # JSON request and one JSON response per line. Timers are kept by id, so
+    # every command except "list" costs the same however many are running.
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.timers = {}
+        self._next_id = 1
+        self._server = None
+        self._stopped = None
+        # Running-timer file changes made while handling requests, written
+        # together once the event loop is idle again.
+        self._state_add = []
+        self._state_remove = []
+        self._state_flush = None
+        self._commands = {
+            "ping": self._ping,
+            "start": self._start,
+            "list": self._list,
+            "get": self._get,
+            "cancel": self._cancel,
+            "shutdown": self._shutdown,
+        }
+
+    async def serve(self):
+        if DaemonClient(self.socket_path).running():
+            raise RuntimeError("stimer daemon already running on " + self.socket_path)
+        if os.path.exists(self.socket_path):
+            # Left behind by a daemon that did not shut down cleanly.
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        self._stopped = asyncio.Event()
+        self._server = await asyncio.start_unix_server(
+            self._handle_client, path=self.socket_path
+        )
+        os.chmod(self.socket_path, 0o600)
+        self._restore()
+        logging.debug("stimer daemon listening on " + self.socket_path)
+        try:
+            await self._stopped.wait()
+        finally:
+            for entry in self.timers.values():
+                if entry["task"] is not None:
+                    entry["task"].cancel()
+            self.timers.clear()
+            if self._state_flush is not None:
+                self._state_flush.cancel()
+                self._flush_state()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(json.dumps(self.handle_request(line)).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def handle_request(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {"ok": False, "error": "Request is not valid JSON."}
+        if not isinstance(request, dict) or request.get("cmd") not in self._commands:
+            return {"ok": False, "error": "Unknown command."}
+        try:
+            return self._commands[request["cmd"]](request)
+        except (KeyError, TypeError, ValueError) as e:
+            return {"ok": False, "error": "Invalid request: " + str(e)}
+
+    def _timer_info(self, timer_id):
+        entry = self.timers[timer_id]
+        snap = entry["timer"].snapshot()
+        return {
+            "id": timer_id,
+            "label": entry["label"],
+            "up": entry["timer"].up,
+            "elapsed": snap.elapsed_clock,
+            "remaining": snap.remaining_clock,
+        }
+
+    def _ping(self, request):
+        return {"ok": True, "pid": os.getpid(), "timers": len(self.timers)}
+
+    def _start(self, request):
+        timer = STimer(**json.loads(request["timer"]))
+        if timer.duration() is None and not timer.up:
+            return {"ok": False, "error": "Timer has no duration."}
+        timer.start(request.get("elapsed_ns", 0))
+        timer_id = self._add(timer, request.get("label"))
+        return {"ok": True, "id": timer_id}
+
+    def _add(self, timer, label=None):
+        timer_id = self._next_id
+        self._next_id = self._next_id + 1
+        label = label or timer.name
+        if not label:
+            label = timer.duration(TimeFormat.CLOCK) or "stopwatch"
+        task = None
+        if timer.duration() is not None:
+            task = asyncio.ensure_future(self._expire(timer_id, timer))
+        state = running_entry(label, timer, owner="daemon")
+        self._update_state(add=[state])
+        self.timers[timer_id] = {
+            "timer": timer,
+            "label": label,
+            "task": task,
+            "state_id": state["id"],
+        }
+        logging.debug("Timer " + str(timer_id) + " started.")
+        return timer_id
+
+    def _restore(self):
+        # Picks up the timers of a daemon that died without shutting down.
+        orphans = get_orphaned_timers("daemon")
+        for entry in orphans:
+            timer = resume_running(entry)
+            if timer is not None and not timer.snapshot().expired:
+                self._add(timer, entry["label"])
+        self._update_state(remove=[entry["id"] for entry in orphans])
+
+    def _update_state(self, add=(), remove=()):
+        self._state_add.extend(add)
+        self._state_remove.extend(remove)
+        if self._state_flush is None:
+            self._state_flush = asyncio.get_running_loop().call_soon(self._flush_state)
+
+    def _flush_state(self):
+        self._state_flush = None
+        # Timers that started and stopped within one batch need no write.
+        removed = set(self._state_remove)
+        add = [entry for entry in self._state_add if entry["id"] not in removed]
+        remove = removed.difference(entry["id"] for entry in self._state_add)
+        self._state_add = []
+        self._state_remove = []
+        if add or remove:
+            update_running(add=add, remove=remove)
+
+    async def _expire(self, timer_id, timer):
+        await timer.wait()
+        entry = self.timers.pop(timer_id, None)
+        if entry is not None:
+            self._update_state(remove=[entry["state_id"]])
+        logging.debug("Timer " + str(timer_id) + " finished.")
+
+    def _list(self, request):
+        return {
+            "ok": True,
+            "timers": [self._timer_info(timer_id) for timer_id in self.timers],
+        }
+
+    def _get(self, request):
+        timer_id = int(request["id"])
+        if timer_id not in self.timers:
+            return {"ok": False, "error": "Timer " + str(timer_id) + " not found."}
+        timer = self.timers[timer_id]["timer"]
+        response = self._timer_info(timer_id)
+        response.update(
+            {"ok": True, "timer": timer.to_json(), "elapsed_ns": timer.elapsed_ns()}
+        )
+        return response
+
+    def _cancel(self, request):
+        timer_id = int(request["id"])
+        entry = self.timers.pop(timer_id, None)
+        if entry is None:
+            return {"ok": False, "error": "Timer " + str(timer_id) + " not found."}
+        if entry["task"] is not None:
+            entry["task"].cancel()
+        self._update_state(remove=[entry["state_id"]])
+        logging.debug("Timer " + str(timer_id) + " cancelled.")
+        return {"ok": True, "id": timer_id}
+
+    def _shutdown(self, request):
+        self._update_state(remove=[entry["state_id"] for entry in self.timers.values()])
+        self._server.close()
+        self._stopped.set()
+        return {"ok": True}
+
+
+def run_daemon(socket_path=None):
+    asyncio.run(STimerDaemon(socket_path).serve())
+
+
+def spawn_daemon(socket_path=None, timeout=2.0):
+    # Detaches from the terminal with the usual fork, setsid, fork and returns
+    # in the original process once the daemon answers on its socket.
+    client = DaemonClient(socket_path)
+    if client.running():
+        return False
+    pid = os.fork()
+    if pid == 0:
+        release_locks_after_fork()
+        os.setsid()
+        os.chdir("/")
+        if os.fork() != 0:
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        try:
+            run_daemon(socket_path)
+        except Exception:
+            os._exit(1)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if client.running():
+            return True
+        time.sleep(0.01)
+    logging.error("stimer daemon did not start.")
+    sys.exit(1)
@@ -0,0 +1,190 @@
+import heapq
+import logging
+import os
+import signal
+import sys
+import time
+
+from .core import NS_PER_SEC, MonotonicClock
+from .output import STimerOutput, alert, fd_encoding, write_fd
+
+
+class STimerEngine:
+    # Runs many timers in one process on one shared clock. The next redraw
+    # time of every timer sits in a heap; the engine sleeps until the earliest
+    # one, redraws only the rows that are due and writes them to the terminal
+    # in a single os.write. Each timer gets one row of the display. With
+    # stream set, each timer writes JSON-line events to stdout instead.
+    def __init__(self, clock=None, fd=None, stream=False):
+        self.clock = clock or MonotonicClock()
+        self.stream = stream
+        if fd is None:
+            fd = sys.stdout.fileno() if stream else sys.stderr.fileno()
+        self.fd = fd
+        self.encoding = fd_encoding(fd)
+        self.outputs = []
+        self._bars = []
+        self._schedulers = []
+        self._line_breaks = stream or not os.isatty(self.fd)
+
+    def add(self, timer, label=None, **output_options):
+        if timer.started() is False:
+            timer.clock = self.clock
+        elif timer.clock is not self.clock:
+            # Move a running timer onto the engine's clock, keeping its elapsed time.
+            elapsed_ns = timer.elapsed_ns()
+            timer.clock = self.clock
+            timer.start(elapsed_ns)
+        output_options["renderer"] = "json" if self.stream else "native"
+        output = STimerOutput(timer, label=label, **output_options)
+        self.outputs.append(output)
+        return output
+
+    def _row_data(self, row, data):
+        if not data or self._line_breaks:
+            return data
+        up = len(self.outputs) - row
+        return "\x1b[" + str(up) + "A" + data + "\x1b[" + str(up) + "B\r"
+
+    def _write(self, data):
+        write_fd(self.fd, data, self.encoding)
+
+    def _on_resize(self, signum, frame):
+        for bar in self._bars:
+            bar._on_resize()
+
+    def _dump_stats(self, signum=None, frame=None):
+        for output in self.outputs:
+            if output.stats is not None:
+                print(output.label.strip() + ":", file=sys.stderr)
+                print(output.stats.report(), file=sys.stderr, flush=True)
+
+    def _row_frame(self, row, snap, event):
+        output = self.outputs[row]
+        if self.stream:
+            return output._get_event(event, snap) + "\n"
+        bar = self._bars[row]
+        variables = output._get_variables(snap)
+        if event == "expired":
+            value = output._get_final_value(snap)
+            return self._row_data(row, bar.frame_data(value, True, **variables))
+        update_value, frame = output._get_frame(bar, snap)
+        return self._row_data(row, bar.frame_data(update_value, **variables))
+
+    def _wake_ns(self, row, now_ns, snap):
+        tick = self._schedulers[row].next_tick(snap.elapsed)
+        if snap.duration is not None and tick >= snap.duration:
+            return self.outputs[row].timer.deadline_ns()
+        return now_ns - snap.elapsed_ns + round(tick * NS_PER_SEC)
+
+    def _sleep(self, wake_ns, row):
+        output = self.outputs[row]
+        if output.plan.precise_expiry is True and wake_ns == output.timer.deadline_ns():
+            self.clock.sleep_until_ns(wake_ns, output.PRECISE_SPIN_NS)
+        else:
+            self.clock.sleep((wake_ns - self.clock.now_ns()) / NS_PER_SEC)
+
+    def _start(self):
+        label_width = 0
+        for i, output in enumerate(self.outputs):
+            if output.label is None:
+                output.label = "#" + str(i + 1)
+            label_width = max(label_width, len(output.label))
+        heap = []
+        data = ""
+        now_ns = self.clock.now_ns()
+        for i, output in enumerate(self.outputs):
+            output.label = output.label.ljust(label_width) + " "
+            if output.timer.started() is False:
+                output.timer.start()
+            snap = output.snapshot()
+            if self.stream:
+                self._schedulers.append(output._get_stream_scheduler(snap))
+                data = data + output._get_event("start", snap) + "\n"
+            else:
+                bar = output._get_progress_bar(snap, fd=self.fd, watch_resize=False)
+                self._bars.append(bar)
+                self._schedulers.append(output._get_scheduler(bar, snap))
+                update_value, frame = output._get_frame(bar, snap)
+                row_data = bar.frame_data(
+                    update_value, force=True, **output._get_variables(snap)
+                )
+                if self._line_breaks:
+                    data = data + row_data
+                else:
+                    data = data + row_data + "\n"
+            heapq.heappush(heap, (self._wake_ns(i, now_ns, snap), i))
+        self._write(data)
+        return heap
+
+    def run(self):
+        if not self.outputs:
+            return
+        prev_winch = None
+        if hasattr(signal, "SIGWINCH") and not self._line_breaks:
+            try:
+                prev_winch = signal.signal(signal.SIGWINCH, self._on_resize)
+            except ValueError:
+                pass
+        prev_usr1 = None
+        if hasattr(signal, "SIGUSR1") and any(output.stats for output in self.outputs):
+            try:
+                prev_usr1 = signal.signal(signal.SIGUSR1, self._dump_stats)
+            except ValueError:
+                pass
+        sound = False
+        heap = []
+        try:
+            heap = self._start()
+            while heap:
+                self._sleep(*heap[0])
+                now_ns = self.clock.now_ns()
+                data = ""
+                drawn = []
+                while heap and heap[0][0] <= now_ns:
+                    wake_ns, row = heapq.heappop(heap)
+                    output = self.outputs[row]
+                    stats = output.stats
+                    if stats is not None:
+                        start_ns = time.perf_counter_ns()
+                        stats.add_wakeup(now_ns - wake_ns)
+                    snap = output.snapshot()
+                    if output._timer_continue(snap):
+                        row_data = self._row_frame(row, snap, "tick")
+                        heapq.heappush(heap, (self._wake_ns(row, now_ns, snap), row))
+                    else:
+                        output._expired()
+                        row_data = self._row_frame(row, snap, "expired")
+                        logging.debug("Timer " + output.label.strip() + " finished.")
+                        if output.plan.sound is True and not self.stream:
+                            row_data = row_data + "\a"
+                            sound = True
+                    if stats is not None:
+                        if row_data:
+                            stats.add_frame(time.perf_counter_ns() - start_ns)
+                            drawn.append(stats)
+                        else:
+                            stats.frames_skipped = stats.frames_skipped + 1
+                    data = data + row_data
+                if data:
+                    start_ns = time.perf_counter_ns()
+                    self._write(data)
+                    # One write serves every row drawn; split its cost evenly.
+                    write_ns = (time.perf_counter_ns() - start_ns) // max(len(drawn), 1)
+                    for stats in drawn:
+                        stats.write_ns = stats.write_ns + write_ns
+        except KeyboardInterrupt:
+            if self.stream:
+                data = ""
+                for wake_ns, row in sorted(heap, key=lambda item: item[1]):
+                    snap = self.outputs[row].snapshot()
+                    data = data + self._row_frame(row, snap, "stopped")
+                self._write(data)
+            raise
+        finally:
+            if prev_winch is not None:
+                signal.signal(signal.SIGWINCH, prev_winch)
+            if prev_usr1 is not None:
+                signal.signal(signal.SIGUSR1, prev_usr1)
+        if not self.stream:
+            alert(sound)
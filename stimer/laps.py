@@ -0,0 +1,167 @@
+import logging
+import os
+import signal
+import sys
+import threading
+from array import array
+
+from .core import STimeData
+
+LAP_CSV_HEADER = "lap,lap_ns,split_ns\n"
+
+
+class LapRecorder:
+    # Lap times as int64 nanoseconds in an array, with running min, mean and
+    # max. Without a path every lap stays in memory at 8 bytes each. With a
+    # path the buffer is written out whenever it fills, so memory stays flat
+    # however long the session runs: ".csv" files get one "lap,lap_ns,split_ns"
+    # row per lap, anything else gets the raw little-endian int64 lap times.
+    BUFFER_LAPS = 8192
+
+    def __init__(self, path=None, buffer_laps=None):
+        self.path = path
+        self.buffer_laps = buffer_laps or self.BUFFER_LAPS
+        self.laps_ns = array("q")
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+        self.last_split_ns = 0
+        self._csv = path is not None and path.endswith(".csv")
+        self._file = None
+        self._flushed = 0
+        self._flushed_split_ns = 0
+        if path is not None:
+            self._file = open(path, "w" if self._csv else "wb")
+            if self._csv:
+                self._file.write(LAP_CSV_HEADER)
+
+    def add(self, split_ns):
+        lap_ns = split_ns - self.last_split_ns
+        self.last_split_ns = split_ns
+        self.laps_ns.append(lap_ns)
+        self.count = self.count + 1
+        self.total_ns = self.total_ns + lap_ns
+        if self.min_ns is None or lap_ns < self.min_ns:
+            self.min_ns = lap_ns
+        if self.max_ns is None or lap_ns > self.max_ns:
+            self.max_ns = lap_ns
+        if self._file is not None and len(self.laps_ns) >= self.buffer_laps:
+            self.flush()
+        return lap_ns
+
+    def mean_ns(self):
+        if not self.count:
+            return None
+        return self.total_ns / self.count
+
+    def flush(self):
+        if self._file is None or not self.laps_ns:
+            return
+        if self._csv:
+            rows = []
+            lap = self._flushed
+            split_ns = self._flushed_split_ns
+            for lap_ns in self.laps_ns:
+                lap = lap + 1
+                split_ns = split_ns + lap_ns
+                rows.append("%d,%d,%d\n" % (lap, lap_ns, split_ns))
+            self._file.write("".join(rows))
+        else:
+            if sys.byteorder == "little":
+                self.laps_ns.tofile(self._file)
+            else:
+                swapped = array("q", self.laps_ns)
+                swapped.byteswap()
+                swapped.tofile(self._file)
+        self._file.flush()
+        self._flushed = self._flushed + len(self.laps_ns)
+        self._flushed_split_ns = self.last_split_ns
+        del self.laps_ns[:]
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def summary(self, precision=6):
+        if not self.count:
+            return "No laps recorded."
+        lines = ["Laps: " + str(self.count)]
+        for name, value_ns in (
+            ("min", self.min_ns),
+            ("mean", self.mean_ns()),
+            ("max", self.max_ns),
+        ):
+            lines.append(
+                "  {:<5}".format(name) + STimeData(value_ns / 1e9).clock(precision)
+            )
+        if self.path is not None:
+            lines.append("  written to " + self.path)
+        return "\n".join(lines)
+
+
+def load_laps(path):
+    laps_ns = array("q")
+    if path.endswith(".csv"):
+        with open(path) as f:
+            if f.readline() != LAP_CSV_HEADER:
+                logging.error("Lap file " + path + " has no lap header.")
+                return None
+            for line in f:
+                laps_ns.append(int(line.split(",")[1]))
+        return laps_ns
+    with open(path, "rb") as f:
+        laps_ns.frombytes(f.read())
+    if sys.byteorder != "little":
+        laps_ns.byteswap()
+    return laps_ns
+
+
+class LapReader:
+    # Records a lap on the timer for every line read from a pipe, or for every
+    # key pressed when stdin is a terminal. Reads on a daemon thread so the
+    # render loop keeps its own timing; the end of a piped input stops the
+    # timer like Ctrl-C would.
+    def __init__(self, timer, stream=None):
+        self.timer = timer
+        self.stream = stream or sys.stdin
+        self._thread = None
+        self._tty_attrs = None
+
+    def start(self):
+        fd = self.stream.fileno()
+        if os.isatty(fd):
+            try:
+                import termios
+                import tty
+            except ImportError:
+                pass
+            else:
+                # Single key presses, not echoed over the progress bar.
+                self._tty_attrs = termios.tcgetattr(fd)
+                tty.setcbreak(fd)
+        target = self._read_keys if self._tty_attrs is not None else self._read_lines
+        self._thread = threading.Thread(target=target, args=(fd,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._tty_attrs is not None:
+            import termios
+
+            termios.tcsetattr(self.stream.fileno(), termios.TCSADRAIN, self._tty_attrs)
+            self._tty_attrs = None
+
+    def _read_keys(self, fd):
+        while True:
+            # One read per key press, escape sequences included.
+            if not os.read(fd, 64):
+                return
+            self.timer.lap()
+
+    def _read_lines(self, fd):
+        with os.fdopen(os.dup(fd), "rb") as f:
+            for line in f:
+                self.timer.lap()
+        os.kill(os.getpid(), signal.SIGINT)
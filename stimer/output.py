@@ -1,159 +1,550 @@
+import json
+import math
+import os
+import signal
 import time
 import logging
 import sys
-import progressbar
-from .core import TimeFormat
+from .core import NS_PER_SEC
 from .confighandler import get_defaults
+from .plan import compile_plan
+
+BAR_MARKER = "\u2588"
+
+
+class TickScheduler:
+    # Each step is a (step, offset) grid of elapsed times at which part of the
+    # display can change. The next tick is the nearest grid point, held back
+    # to max_fps and never later than the deadline. Ticks land just past the
+    # grid point since round() resolves exact ties to even.
+    TIE_BREAK = 1e-6
+
+    def __init__(self, steps, max_fps=None, deadline=None):
+        self.steps = [(step, offset) for step, offset in steps if step > 0]
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.deadline = deadline
+
+    def next_tick(self, elapsed):
+        tick = None
+        for step, offset in self.steps:
+            boundary = offset + (math.floor((elapsed - offset) / step) + 1) * step
+            boundary = boundary + self.TIE_BREAK
+            if tick is None or boundary < tick:
+                tick = boundary
+        earliest = elapsed + self.min_interval
+        if tick is None or tick < earliest:
+            tick = earliest
+        if self.deadline is not None and tick > self.deadline:
+            tick = self.deadline
+        return tick
+
+
+class OutputStats:
+    # Opt-in counters for one STimerOutput: frames drawn and skipped, time
+    # spent building frames versus writing them, and how late the render loop
+    # woke up compared with the tick it slept for.
+    LATENESS_BOUNDS_US = (100, 500, 1000, 2000, 5000, 10000, 50000)
+
+    def __init__(self):
+        self.frames_rendered = 0
+        self.frames_skipped = 0
+        self.format_ns = 0
+        self.write_ns = 0
+        self.wakeups = 0
+        self.early_wakeups = 0
+        self.lateness_total_ns = 0
+        self.lateness_max_ns = 0
+        self.lateness_counts = [0] * (len(self.LATENESS_BOUNDS_US) + 1)
+
+    def add_frame(self, format_ns, write_ns=0):
+        self.frames_rendered = self.frames_rendered + 1
+        self.format_ns = self.format_ns + format_ns
+        self.write_ns = self.write_ns + write_ns
+
+    def add_wakeup(self, lateness_ns):
+        self.wakeups = self.wakeups + 1
+        if lateness_ns < 0:
+            self.early_wakeups = self.early_wakeups + 1
+            return
+        self.lateness_total_ns = self.lateness_total_ns + lateness_ns
+        self.lateness_max_ns = max(self.lateness_max_ns, lateness_ns)
+        lateness_us = lateness_ns / 1000
+        for i, bound in enumerate(self.LATENESS_BOUNDS_US):
+            if lateness_us < bound:
+                self.lateness_counts[i] = self.lateness_counts[i] + 1
+                return
+        self.lateness_counts[-1] = self.lateness_counts[-1] + 1
+
+    def as_dict(self):
+        labels = ["<" + str(bound) + "us" for bound in self.LATENESS_BOUNDS_US]
+        labels.append(">=" + str(self.LATENESS_BOUNDS_US[-1]) + "us")
+        return {
+            "frames_rendered": self.frames_rendered,
+            "frames_skipped": self.frames_skipped,
+            "format_ns": self.format_ns,
+            "write_ns": self.write_ns,
+            "wakeups": self.wakeups,
+            "early_wakeups": self.early_wakeups,
+            "lateness_max_ns": self.lateness_max_ns,
+            "lateness_total_ns": self.lateness_total_ns,
+            "lateness_histogram": dict(zip(labels, self.lateness_counts)),
+        }
+
+    def report(self):
+        frames = max(self.frames_rendered, 1)
+        late_wakeups = max(self.wakeups - self.early_wakeups, 1)
+        lines = [
+            "frames rendered: {}".format(self.frames_rendered),
+            "frames skipped: {}".format(self.frames_skipped),
+            "format time: {:.3f} ms ({:.1f} us/frame)".format(
+                self.format_ns / 1e6, self.format_ns / frames / 1e3
+            ),
+            "write time: {:.3f} ms ({:.1f} us/frame)".format(
+                self.write_ns / 1e6, self.write_ns / frames / 1e3
+            ),
+            "wake-ups: {} ({} early), lateness mean {:.3f} ms, max {:.3f} ms".format(
+                self.wakeups,
+                self.early_wakeups,
+                self.lateness_total_ns / late_wakeups / 1e6,
+                self.lateness_max_ns / 1e6,
+            ),
+            "lateness histogram:",
+        ]
+        for label, count in self.as_dict()["lateness_histogram"].items():
+            lines.append("  {:>9} {}".format(label, count))
+        return "\n".join(lines)
+
+
+def fd_encoding(fd):
+    # The encoding of the standard stream open on fd, else the locale's.
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            if stream is not None and stream.fileno() == fd and stream.encoding:
+                return stream.encoding
+        except (AttributeError, OSError, ValueError):
+            pass
+    import locale
+
+    return locale.getpreferredencoding(False)
+
+
+def write_fd(fd, data, encoding):
+    # os.write can stop short on pipes and terminals; loop until all is out.
+    data = data.encode(encoding, "replace")
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+class ANSIRenderer:
+    # Draws the timer line the way the progressbar2 widgets lay it out. Every
+    # widget keeps a fixed column, so a frame only rewrites the characters of
+    # the widgets that changed, addressed by column, in a single os.write. The
+    # bar strings for every fill level are built once per layout. On a
+    # non-terminal each frame is written as a full line instead.
+    def __init__(
+        self, widgets, max_value=None, variables=None, fd=None, watch_resize=True
+    ):
+        self.widgets = widgets
+        self.max_value = max_value
+        self.variables = dict(variables or {})
+        self.fd = sys.stderr.fileno() if fd is None else fd
+        self.encoding = fd_encoding(self.fd)
+        self.line_breaks = not os.isatty(self.fd)
+        self.term_width = self._terminal_width()
+        self._parts = None
+        self._layout_key = None
+        self._bars = None
+        self._resized = False
+        self._prev_winch = None
+        if watch_resize and hasattr(signal, "SIGWINCH") and not self.line_breaks:
+            try:
+                self._prev_winch = signal.signal(signal.SIGWINCH, self._on_resize)
+            except ValueError:
+                # Not the main thread; keep the width found at start.
+                pass
+
+    def _terminal_width(self):
+        try:
+            return os.get_terminal_size(self.fd).columns or 80
+        except OSError:
+            return 80
+
+    def _on_resize(self, signum=None, frame=None):
+        self._resized = True
+
+    def _layout(self, texts_len):
+        key = (texts_len, self.term_width)
+        if key != self._layout_key:
+            width = max(self.term_width - texts_len - 2, 0)
+            self._bars = [
+                " " + BAR_MARKER * cells + " " * (width - cells) + " "
+                for cells in range(width + 1)
+            ]
+            self._layout_key = key
+        return self._bars
+
+    def _render_parts(self, value):
+        texts = []
+        texts_len = 0
+        for widget in self.widgets:
+            if widget != "bar":
+                text = str(self.variables.get(widget, ""))
+                texts.append(text)
+                texts_len = texts_len + len(text)
+        parts = []
+        for widget in self.widgets:
+            if widget == "bar":
+                bars = self._layout(texts_len)
+                cells = 0
+                if self.max_value and value:
+                    cells = int(value / self.max_value * (len(bars) - 1))
+                    cells = min(max(cells, 0), len(bars) - 1)
+                parts.append(bars[cells])
+                texts_len = texts_len + len(bars[0])
+            else:
+                parts.append(texts.pop(0))
+        if texts_len < self.term_width:
+            parts.append(" " * (self.term_width - texts_len))
+        return parts
+
+    def render(self, value=None):
+        return "".join(self._render_parts(value))
+
+    def update(self, value=None, force=False, **variables):
+        data = self.frame_data(value, force, **variables)
+        if data:
+            self._write(data)
+
+    def frame_data(self, value=None, force=False, **variables):
+        # Returns what update() would write for this frame, without writing.
+        self.variables.update(variables)
+        if self._resized:
+            self._resized = False
+            self.term_width = self._terminal_width()
+            self._parts = None
+        parts = self._render_parts(value)
+        old = self._parts
+        # A forced repeat only matters on a terminal, where it redraws the line.
+        if parts == old and (not force or self.line_breaks):
+            return ""
+        self._parts = parts
+        if self.line_breaks:
+            data = "".join(parts).rstrip() + "\n"
+        elif old is None or [len(part) for part in old] != [
+            len(part) for part in parts
+        ]:
+            data = "\r" + "".join(parts)
+        else:
+            data = ""
+            column = 1
+            for old_part, part in zip(old, parts):
+                if old_part != part:
+                    start = len(os.path.commonprefix([old_part, part]))
+                    end = len(part) - len(
+                        os.path.commonprefix([old_part[::-1], part[::-1]])
+                    )
+                    data = data + "\x1b[" + str(column + start) + "G"
+                    data = data + part[start:end]
+                column = column + len(part)
+        return data
+
+    def _write(self, data):
+        write_fd(self.fd, data, self.encoding)
+
+    def finish(self, dirty=False):
+        if self._parts is not None and not self.line_breaks:
+            self._write("\n")
+        if self._prev_winch is not None:
+            signal.signal(signal.SIGWINCH, self._prev_winch)
+            self._prev_winch = None
+
+
+def alert(sound, error_ns=None):
+    message = "Time's up!"
+    if error_ns is not None:
+        message = message + " ({:+.3f} ms from deadline)".format(error_ns / 1e6)
+    if sound is True:
+        print(message + " Control + C to exit.", end="", flush=True)
+        while True:
+            print("\a", end="", flush=True)
+            time.sleep(0.5)
+    else:
+        print(message)
 
 
 class STimerOutput:
-    def __init__(self, timer):
+    # In precise mode the last sleep before expiry stops this far short of
+    # the deadline and spins the rest of the way.
+    PRECISE_SPIN_NS = 2000000
+
+    def __init__(
+        self,
+        timer,
+        max_fps=None,
+        renderer=None,
+        label=None,
+        stream_interval=None,
+        stats=False,
+        precise=None,
+        plan=None,
+    ):
         self.timer = timer
-        self.output_fmt = self._init_output_fmt(timer)
-
-    def _init_output_fmt(self, timer):
-        output_fmt = {}
-        defaults = get_defaults()
-
-        def widget_fmt(fmt):
-            if fmt == "simple":
-                output_fmt["progress_bar"] = False
-                if timer.up:
-                    output_fmt["elapsed"] = True
-                    output_fmt["remaining"] = False
-                else:
-                    output_fmt["elapsed"] = False
-                    output_fmt["remaining"] = True
-            elif fmt == "full":
-                output_fmt["progress_bar"] = True
-                output_fmt["elapsed"] = True
-                output_fmt["remaining"] = True
-
-        if timer.up is not None:
-            output_fmt["up"] = timer.up
-        else:
-            output_fmt["up"] = defaults["up"]
-        if timer.sound is not None:
-            output_fmt["sound"] = timer.sound
-        else:
-            output_fmt["sound"] = defaults["sound"]
-        if timer.widget_fmt:
-            widget_fmt(timer.widget_fmt)
-        else:
-            widget_fmt(defaults["widget_fmt"])
-        if timer.precision:
-            output_fmt["precision"] = timer.precision
-        else:
-            output_fmt["precision"] = defaults["precision"]
-        return output_fmt
+        self.label = label
+        self.stats = OutputStats() if stats else None
+        self.expiry_error_ns = None
+        if plan is None:
+            plan = compile_plan(
+                timer,
+                get_defaults(),
+                max_fps=max_fps,
+                renderer=renderer,
+                stream_interval=stream_interval,
+                precise=precise,
+            )
+        self.plan = plan
+
+    def snapshot(self):
+        return self.plan.snapshot(self.timer.elapsed_ns())
 
-    def _timer_continue(self):
-        if self.output_fmt["up"]:
-            if self.timer.duration() is None:
+    def _timer_continue(self, snap=None):
+        if snap is None:
+            snap = self.snapshot()
+        if self.plan.up:
+            if snap.duration is None:
                 return True
-            elif self.timer.elapsed() < self.timer.duration():
+            elif snap.elapsed < snap.duration:
                 return True
         else:
-            if self.timer.remaining() > 0:
+            if snap.remaining > 0:
                 return True
         return False
 
-    def _get_progress_bar(self):
-        wgt_remaining = None
-        wgt_elapsed = None
-        wgt_bar = None
-        bar_max_value = None
-        if self.output_fmt["remaining"] is True and self.timer.duration():
-            wgt_remaining = progressbar.Variable(name="remaining", format="{value}")
-        if self.output_fmt["elapsed"] is True:
-            wgt_elapsed = progressbar.Variable(name="elapsed", format="{value}")
-        if self.output_fmt["progress_bar"] is True and self.timer.duration():
-            wgt_bar = progressbar.Bar(marker="\u2588", left=" ", right=" ")
-            bar_max_value = self.timer.duration()
-        left_text = None
-        right_text = None
-        if self.output_fmt["up"]:
-            left_text = wgt_elapsed
-            right_text = wgt_remaining
-        else:
-            left_text = wgt_remaining
-            right_text = wgt_elapsed
-        widget_list = [left_text, wgt_bar, right_text]
+    def _get_progress_bar(self, snap, **renderer_options):
+        widgets = list(self.plan.widgets)
+        if self.label is not None:
+            widgets.insert(0, "label")
+        bar_max_value = self.plan.bar_max_value
+        variables = {
+            "label": self.label,
+            "remaining": snap.remaining_clock,
+            "elapsed": snap.elapsed_clock,
+        }
+        if self.plan.renderer == "progressbar":
+            try:
+                return self._get_progressbar2(widgets, bar_max_value, variables)
+            except ImportError:
+                logging.warning("progressbar2 is not installed, using native output.")
+        return ANSIRenderer(
+            widgets, max_value=bar_max_value, variables=variables, **renderer_options
+        )
+
+    def _get_progressbar2(self, widget_names, bar_max_value, variables):
+        import progressbar
+
         widgets = []
-        for wgt in widget_list:
-            if wgt is not None:
-                widgets.append(wgt)
+        for name in widget_names:
+            if name == "bar":
+                widgets.append(progressbar.Bar(marker=BAR_MARKER, left=" ", right=" "))
+            else:
+                widgets.append(progressbar.Variable(name=name, format="{value}"))
         bar = progressbar.ProgressBar(
             max_value=bar_max_value,
             widgets=widgets,
-            variables={
-                "remaining": self.timer.remaining(TimeFormat.CLOCK),
-                "elapsed": self.timer.elapsed(TimeFormat.CLOCK),
-            },
+            variables=variables,
         )
         return bar
 
+    def _get_scheduler(self, bar, snap):
+        precision = snap.precision or 0
+        step = 10**-precision
+        duration = snap.duration
+        steps = []
+        if self.plan.show_elapsed is True:
+            steps.append((step, step / 2))
+        if self.plan.show_remaining is True and duration:
+            steps.append((step, (duration - step / 2) % step))
+        if self.plan.progress_bar is True and duration:
+            steps.append((duration / bar.term_width, 0.0))
+        if not steps:
+            steps.append((step, step / 2))
+        return TickScheduler(steps, self.plan.max_fps, duration)
+
+    def _get_frame(self, bar, snap):
+        update_value = None
+        bar_cells = None
+        if self.plan.progress_bar is True:
+            if self.plan.up:
+                update_value = snap.elapsed
+            else:
+                update_value = snap.remaining
+            if snap.duration:
+                bar_cells = int(update_value / snap.duration * bar.term_width)
+        else:
+            update_value = 100
+        remaining = None
+        if snap.remaining:
+            remaining = snap.remaining_clock
+        frame = (bar_cells, remaining, snap.elapsed_clock)
+        return update_value, frame
+
+    def _get_final_value(self, snap):
+        if self.plan.up is True and snap.duration:
+            return snap.duration
+        return 0
+
+    def _get_variables(self, snap):
+        if snap.remaining:
+            return {"remaining": snap.remaining_clock, "elapsed": snap.elapsed_clock}
+        return {"elapsed": snap.elapsed_clock}
+
+    def _sleep_to_tick(self, tick, snap):
+        clock = self.timer.clock
+        if (
+            self.plan.precise_expiry is True
+            and snap.duration is not None
+            and tick >= snap.duration
+        ):
+            deadline_ns = self.timer.deadline_ns()
+            clock.sleep_until_ns(deadline_ns, self.PRECISE_SPIN_NS)
+        else:
+            clock.sleep(tick - self.timer.elapsed_ns() / NS_PER_SEC)
+
+    def _expired(self):
+        # Measured when the alert goes out, so it includes the final redraw.
+        if self.plan.precise_expiry is True:
+            deadline_ns = self.timer.deadline_ns()
+            if deadline_ns is not None:
+                self.expiry_error_ns = self.timer.clock.now_ns() - deadline_ns
+        return self.expiry_error_ns
+
+    def _get_stream_scheduler(self, snap):
+        return TickScheduler([(self.plan.stream_interval, 0.0)], deadline=snap.duration)
+
+    def _get_event(self, event, snap):
+        data = {"event": event, "time": round(time.time(), 3)}
+        if self.label is not None:
+            data["label"] = self.label.strip()
+        if event == "start":
+            data["up"] = self.plan.up
+            data["duration"] = snap.duration
+        data["elapsed"] = round(snap.elapsed, 3)
+        if snap.duration is not None:
+            data["remaining"] = round(snap.remaining, 3)
+        if event == "expired" and self.expiry_error_ns is not None:
+            data["error_ms"] = round(self.expiry_error_ns / 1e6, 3)
+        return json.dumps(data)
+
+    def stream_output(self):
+        # JSON lines for logs and other programs: a start event, a tick event
+        # every stream_interval seconds of elapsed time and an expired event,
+        # so the output size depends only on the duration.
+        snap = self.snapshot()
+        print(self._get_event("start", snap), flush=True)
+        scheduler = self._get_stream_scheduler(snap)
+        stats = self.stats
+        try:
+            while self._timer_continue(snap) is True:
+                tick = scheduler.next_tick(snap.elapsed)
+                self._sleep_to_tick(tick, snap)
+                snap = self.snapshot()
+                if stats is not None:
+                    stats.add_wakeup(snap.elapsed_ns - round(tick * NS_PER_SEC))
+                if self._timer_continue(snap) is True:
+                    start_ns = time.perf_counter_ns()
+                    event = self._get_event("tick", snap)
+                    written_ns = time.perf_counter_ns()
+                    print(event, flush=True)
+                    if stats is not None:
+                        stats.add_frame(
+                            written_ns - start_ns, time.perf_counter_ns() - written_ns
+                        )
+        except KeyboardInterrupt:
+            print(self._get_event("stopped", self.snapshot()), flush=True)
+            return
+        self._expired()
+        print(self._get_event("expired", snap), flush=True)
+
     def start_output(self):
         if self.timer.started() is False:
             logging.critical(
                 '"STimer.start()" must be called before "STimerOutput.start_output()".'
             )
             sys.exit(1)
+        prev_usr1 = None
+        if self.stats is not None and hasattr(signal, "SIGUSR1"):
+            try:
+                prev_usr1 = signal.signal(signal.SIGUSR1, self._dump_stats)
+            except ValueError:
+                pass
+        try:
+            if self.plan.renderer == "json":
+                self.stream_output()
+            else:
+                self.render_output()
+        finally:
+            if prev_usr1 is not None:
+                signal.signal(signal.SIGUSR1, prev_usr1)
+
+    def _dump_stats(self, signum=None, frame=None):
+        print("\n" + self.stats.report(), file=sys.stderr, flush=True)
+
+    def _draw(self, bar, value, start_ns=None, force=False, **variables):
+        stats = self.stats
+        if stats is None:
+            bar.update(value, force=force, **variables)
+            return
+        if start_ns is None:
+            start_ns = time.perf_counter_ns()
+        if isinstance(bar, ANSIRenderer):
+            data = bar.frame_data(value, force, **variables)
+            formatted_ns = time.perf_counter_ns()
+            if not data:
+                stats.frames_skipped = stats.frames_skipped + 1
+                return
+            bar._write(data)
+        else:
+            # progressbar2 formats and writes in one call.
+            formatted_ns = start_ns
+            bar.update(value, force=force, **variables)
+        stats.add_frame(formatted_ns - start_ns, time.perf_counter_ns() - formatted_ns)
+
+    def render_output(self):
         finished = False
+        stats = self.stats
         try:
-            bar = self._get_progress_bar()
-            if self.timer.duration():
-                print(
-                    "Timer started with duration "
-                    + self.timer.duration(TimeFormat.CLOCK)
-                )
+            snap = self.snapshot()
+            bar = self._get_progress_bar(snap)
+            if snap.duration:
+                print("Timer started with duration " + snap.duration_clock)
             else:
                 print("Timer started:")
-            while self._timer_continue() is True:
-                update_value = None
-                if self.output_fmt["progress_bar"] is True:
-                    if self.output_fmt["up"]:
-                        update_value = self.timer.elapsed()
-                    else:
-                        update_value = self.timer.remaining()
-                else:
-                    update_value = 100
-                if self.timer.remaining():
-                    bar.update(
-                        update_value,
-                        remaining=self.timer.remaining(TimeFormat.CLOCK),
-                        elapsed=self.timer.elapsed(TimeFormat.CLOCK),
-                    )
-                else:
-                    bar.update(
-                        update_value, elapsed=self.timer.elapsed(TimeFormat.CLOCK)
-                    )
-            if self.output_fmt["up"] is True and self.timer.duration():
-                update_value = self.timer.duration()
-            else:
-                update_value = 0
-            if self.timer.remaining():
-                bar.update(
-                    update_value,
-                    force=True,
-                    remaining=self.timer.remaining(TimeFormat.CLOCK),
-                    elapsed=self.timer.elapsed(TimeFormat.CLOCK),
-                )
-            else:
-                bar.update(
-                    update_value,
-                    force=True,
-                    elapsed=self.timer.elapsed(TimeFormat.CLOCK),
-                )
+            scheduler = self._get_scheduler(bar, snap)
+            last_frame = None
+            while self._timer_continue(snap) is True:
+                start_ns = None
+                if stats is not None:
+                    start_ns = time.perf_counter_ns()
+                update_value, frame = self._get_frame(bar, snap)
+                if frame != last_frame:
+                    self._draw(bar, update_value, start_ns, **self._get_variables(snap))
+                    last_frame = frame
+                elif stats is not None:
+                    stats.frames_skipped = stats.frames_skipped + 1
+                tick = scheduler.next_tick(snap.elapsed)
+                self._sleep_to_tick(tick, snap)
+                snap = self.snapshot()
+                if stats is not None:
+                    stats.add_wakeup(snap.elapsed_ns - round(tick * NS_PER_SEC))
+            self._draw(
+                bar,
+                self._get_final_value(snap),
+                force=True,
+                **self._get_variables(snap)
+            )
             bar.finish(dirty=True)
             finished = True
-            if self.output_fmt["sound"] is True:
-                print("Time's up! Control + C to exit.", end="", flush=True)
-                while True:
-                    print("\a", end="", flush=True)
-                    time.sleep(0.5)
-            else:
-                print("Time's up!")
+            alert(self.plan.sound, self._expired())
         except KeyboardInterrupt:
             if finished is True:
                 print()
@@ -0,0 +1,103 @@
+import math
+from collections import namedtuple
+
+from .core import NS_PER_SEC, STimerSnapshot
+
+_PLAN_FIELDS = (
+    "duration",
+    "duration_ns",
+    "up",
+    "sound",
+    "precision",
+    "duration_precision",
+    "progress_bar",
+    "show_elapsed",
+    "show_remaining",
+    "widgets",
+    "bar_max_value",
+    "max_fps",
+    "renderer",
+    "stream_interval",
+    "precise_expiry",
+)
+
+
+class TimerPlan(namedtuple("TimerPlan", _PLAN_FIELDS)):
+    # Everything the output loop needs to know about a timer, resolved once
+    # from the timer's own options, the overrides given on the command line
+    # and the config defaults. Plans are immutable; change the timer and
+    # compile a new one.
+    __slots__ = ()
+
+    def snapshot(self, elapsed_ns):
+        return STimerSnapshot(
+            elapsed_ns, self.duration, self.precision, self.duration_precision
+        )
+
+
+def compile_plan(
+    timer,
+    defaults,
+    max_fps=None,
+    renderer=None,
+    stream_interval=None,
+    precise=None,
+):
+    duration = timer.duration()
+    duration_ns = None
+    if duration is not None:
+        duration_ns = math.ceil(duration * NS_PER_SEC)
+
+    up = timer.up if timer.up is not None else defaults["up"]
+    sound = timer.sound if timer.sound is not None else defaults["sound"]
+    precision = timer.precision
+    if precision is None:
+        precision = defaults["precision"]
+    duration_precision = timer.duration_precision
+    if duration_precision is None:
+        duration_precision = precision
+
+    widget_fmt = timer.widget_fmt or defaults["widget_fmt"]
+    if widget_fmt == "simple":
+        progress_bar = False
+        show_elapsed = bool(up)
+        show_remaining = not up
+    else:
+        progress_bar = True
+        show_elapsed = True
+        show_remaining = True
+
+    wgt_remaining = None
+    wgt_bar = None
+    bar_max_value = None
+    if show_remaining and duration:
+        wgt_remaining = "remaining"
+    wgt_elapsed = "elapsed" if show_elapsed else None
+    if progress_bar and duration:
+        wgt_bar = "bar"
+        bar_max_value = duration
+    if up:
+        layout = (wgt_elapsed, wgt_bar, wgt_remaining)
+    else:
+        layout = (wgt_remaining, wgt_bar, wgt_elapsed)
+    widgets = tuple(widget for widget in layout if widget is not None)
+
+    return TimerPlan(
+        duration=duration,
+        duration_ns=duration_ns,
+        up=up,
+        sound=sound,
+        precision=precision,
+        duration_precision=duration_precision,
+        progress_bar=progress_bar,
+        show_elapsed=show_elapsed,
+        show_remaining=show_remaining,
+        widgets=widgets,
+        bar_max_value=bar_max_value,
+        max_fps=defaults["max_fps"] if max_fps is None else max_fps,
+        renderer=defaults["renderer"] if renderer is None else renderer,
+        stream_interval=(
+            defaults["stream_interval"] if stream_interval is None else stream_interval
+        ),
+        precise_expiry=defaults["precise_expiry"] if precise is None else precise,
+    )
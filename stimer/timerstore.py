@@ -0,0 +1,122 @@
+import importlib.util
+import logging
+
+from pathlib import Path
+
+# sqlite3 is imported on first use; Python can be built without it.
+SQLITE_AVAILABLE = importlib.util.find_spec("sqlite3") is not None
+
+
+class SQLiteTimerStore:
+    # Saved timers kept in an indexed SQLite table instead of the TIMERS
+    # section of stimer.conf. Names are case-folded like configparser keys.
+    def __init__(self, path):
+        self.path = Path(path)
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            import sqlite3
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path))
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS timers "
+                    "(name TEXT PRIMARY KEY, timer TEXT NOT NULL)"
+                )
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS meta "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM timers").fetchone()[0]
+
+    def get(self, name):
+        row = (
+            self._connect()
+            .execute("SELECT timer FROM timers WHERE name = ?", (name.lower(),))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return row[0]
+
+    def items(self, pattern=None):
+        if pattern is None:
+            cursor = self._connect().execute(
+                "SELECT name, timer FROM timers ORDER BY rowid"
+            )
+        else:
+            # fnmatch-style glob; SQLite spells a negated set [^...].
+            cursor = self._connect().execute(
+                "SELECT name, timer FROM timers WHERE name GLOB ? ORDER BY rowid",
+                (pattern.replace("[!", "[^"),),
+            )
+        for row in cursor:
+            yield row[0], row[1]
+
+    def names(self):
+        cursor = self._connect().execute("SELECT name FROM timers ORDER BY rowid")
+        for row in cursor:
+            yield row[0]
+
+    def put(self, name, timer_json):
+        self.put_many([(name, timer_json)])
+
+    def put_many(self, items, meta=None):
+        # Timers and meta values are committed together.
+        conn = self._connect()
+        with conn:
+            for key, value in (meta or {}).items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    (key, value),
+                )
+            for name, timer_json in items:
+                name = name.lower()
+                # Update in place first so overwritten timers keep their order.
+                cursor = conn.execute(
+                    "UPDATE timers SET timer = ? WHERE name = ?", (timer_json, name)
+                )
+                if cursor.rowcount == 0:
+                    conn.execute(
+                        "INSERT INTO timers (name, timer) VALUES (?, ?)",
+                        (name, timer_json),
+                    )
+
+    def get_meta(self, key):
+        row = (
+            self._connect()
+            .execute("SELECT value FROM meta WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return row[0]
+
+    def put_meta(self, key, value):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    def remove(self, name):
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute("DELETE FROM timers WHERE name = ?", (name.lower(),))
+        if cursor.rowcount > 0:
+            logging.debug("Timer " + name + " deleted from " + self.path.name)
+            return True
+        return False
@@ -0,0 +1,483 @@
+import configparser
+import io
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from stimer import confighandler
+from stimer.core import STimer
+
+
+class ConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        config_dir = self.tmp_dir.name + "/"
+        patches = [
+            mock.patch.object(confighandler, "CONFIG_DIR", config_dir),
+            mock.patch.object(
+                confighandler, "CONFIG_FILE", Path(config_dir + "stimer.conf")
+            ),
+            mock.patch.dict(confighandler._config_cache, {"key": None}),
+            mock.patch.dict(confighandler._timer_stores, clear=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.addCleanup(self._close_stores)
+
+    def _close_stores(self):
+        for store in confighandler._timer_stores.values():
+            store.close()
+
+
+class TestConfigCache(ConfigTestCase):
+    def test_list_parses_once(self):
+        for i in range(20):
+            confighandler.save_timer(STimer(duration=i + 1))
+        confighandler._config_cache["key"] = None
+        with mock.patch.object(
+            configparser.ConfigParser,
+            "read_string",
+            autospec=True,
+            side_effect=configparser.ConfigParser.read_string,
+        ) as read_string:
+            timers = confighandler.get_timers_list()
+            for name, timer in timers:
+                confighandler.load_timer(name)
+        self.assertEqual(len(timers), 20)
+        self.assertEqual(read_string.call_count, 1)
+
+    def test_external_change_invalidates(self):
+        confighandler.write_value("up", "true")
+        self.assertEqual(confighandler.read_value("up"), "true")
+        with open(confighandler.CONFIG_FILE, "w") as f:
+            f.write("[GLOBAL]\nup = false\nsound = false\n")
+        self.assertEqual(confighandler.read_value("up"), "false")
+        self.assertEqual(confighandler.read_value("sound"), "false")
+
+    def test_find_timer_number(self):
+        for name in ("1", "2", "4"):
+            timer = STimer(duration=5, name=name)
+            confighandler.save_timer(timer)
+        self.assertEqual(confighandler._find_timer_number(), "3")
+        confighandler.remove_timer("1")
+        self.assertEqual(confighandler._find_timer_number(), "1")
+
+    def test_timer_numbers_fill_gaps(self):
+        confighandler.save_timer(STimer(duration=5, name="3"))
+        names = [confighandler.save_timer(STimer(duration=5)) for _ in range(5)]
+        self.assertEqual(names, ["1", "2", "4", "5", "6"])
+        for name in ("5", "2", "3"):
+            confighandler.remove_timer(name)
+        names = [confighandler.save_timer(STimer(duration=5)) for _ in range(4)]
+        self.assertEqual(names, ["2", "3", "5", "7"])
+        state = json.loads(confighandler.read_value("timer_numbers", "STATE"))
+        self.assertEqual(state, {"next": 7, "free": []})
+
+    def test_timer_number_lookups_constant(self):
+        with confighandler.config_batch():
+            for _ in range(300):
+                confighandler.save_timer(STimer(duration=5))
+        with mock.patch.object(
+            confighandler.ConfigTimerStore,
+            "__contains__",
+            autospec=True,
+            side_effect=confighandler.ConfigTimerStore.__contains__,
+        ) as contains:
+            self.assertEqual(confighandler.save_timer(STimer(duration=5)), "301")
+        self.assertLessEqual(contains.call_count, 2)
+
+
+class TestConfigWrites(ConfigTestCase):
+    def test_defaults_written_once(self):
+        with mock.patch.object(
+            confighandler, "_replace_file", wraps=confighandler._replace_file
+        ) as replace_file:
+            self.assertEqual(confighandler.get_defaults(), confighandler.DEFAULTS)
+            confighandler.get_defaults()
+            confighandler._config_cache["key"] = None
+            confighandler.get_defaults()
+        self.assertEqual(replace_file.call_count, 1)
+
+    def test_unchanged_value_not_written(self):
+        confighandler.write_value("up", "true")
+        with mock.patch.object(confighandler, "_replace_file") as replace_file:
+            confighandler.write_value("up", "true")
+        replace_file.assert_not_called()
+
+    def test_batch_single_write(self):
+        with mock.patch.object(
+            confighandler, "_replace_file", wraps=confighandler._replace_file
+        ) as replace_file:
+            with confighandler.config_batch():
+                confighandler.get_defaults()
+                for i in range(5):
+                    confighandler.save_timer(STimer(duration=i + 1))
+                confighandler.remove_timer("2")
+            self.assertEqual(replace_file.call_count, 1)
+        confighandler._config_cache["key"] = None
+        names = [timer[0] for timer in confighandler.get_timers_list()]
+        self.assertEqual(names, ["1", "3", "4", "5"])
+
+    def test_no_temp_files_left(self):
+        confighandler.write_value("up", "true")
+        confighandler.write_value("up", "false")
+        files = sorted(path.name for path in Path(self.tmp_dir.name).iterdir())
+        expected = ["stimer.conf"]
+        if confighandler.fcntl is not None:
+            expected.append("stimer.conf.lock")
+        self.assertEqual(files, expected)
+
+    def test_symlink_kept(self):
+        target = Path(self.tmp_dir.name, "dotfiles", "stimer.conf")
+        target.parent.mkdir()
+        target.write_text("")
+        confighandler.CONFIG_FILE.symlink_to(target)
+        confighandler.write_value("up", "true")
+        self.assertTrue(confighandler.CONFIG_FILE.is_symlink())
+        self.assertIn("up = true", target.read_text())
+        self.assertEqual(
+            sorted(path.name for path in target.parent.iterdir()), ["stimer.conf"]
+        )
+
+    def test_permissions(self):
+        umask = os.umask(0o077)
+        try:
+            confighandler.write_value("up", "true")
+        finally:
+            os.umask(umask)
+        mode = confighandler.CONFIG_FILE.stat().st_mode & 0o777
+        self.assertEqual(mode, 0o600)
+        # Existing files keep their mode.
+        confighandler.CONFIG_FILE.chmod(0o640)
+        confighandler.write_value("up", "false")
+        mode = confighandler.CONFIG_FILE.stat().st_mode & 0o777
+        self.assertEqual(mode, 0o640)
+
+
+@unittest.skipUnless(confighandler.SQLITE_AVAILABLE, "sqlite3 not available")
+class TestSQLiteTimerStore(ConfigTestCase):
+    def setUp(self):
+        super().setUp()
+        confighandler.write_value("timer_store", '"sqlite"')
+
+    def test_migration(self):
+        confighandler.write_value("timer_store", '"config"')
+        confighandler.save_timer(STimer(duration=5))
+        confighandler.save_timer(STimer(duration=10, name="Tea"))
+        confighandler.write_value("timer_store", '"sqlite"')
+        names = [timer[0] for timer in confighandler.get_timers_list()]
+        self.assertEqual(names, ["1", "tea"])
+        self.assertIsNone(confighandler.read_value("1", "TIMERS"))
+        self.assertTrue(Path(self.tmp_dir.name, "timers.db").exists())
+
+    def test_save_load_remove(self):
+        self.assertEqual(confighandler.save_timer(STimer(duration=5)), "1")
+        self.assertEqual(confighandler.save_timer(STimer(duration=6)), "2")
+        confighandler.save_timer(STimer(duration=7, name="Eggs"))
+        self.assertEqual(confighandler.load_timer("EGGS").duration(), 7)
+        self.assertTrue(confighandler.remove_timer("1"))
+        self.assertFalse(confighandler.remove_timer("1"))
+        self.assertEqual(confighandler.save_timer(STimer(duration=8)), "1")
+        names = [timer[0] for timer in confighandler.get_timers_list()]
+        self.assertEqual(names, ["2", "eggs", "1"])
+
+    def test_overwrite_keeps_order(self):
+        store = confighandler._timer_store()
+        store.put("a", "1")
+        store.put("b", "2")
+        store.put("a", "3")
+        self.assertEqual(list(store.items()), [("a", "3"), ("b", "2")])
+        self.assertEqual(len(store), 2)
+
+
+@unittest.skipIf(confighandler.fcntl is None, "fcntl not available")
+class TestConfigLocking(ConfigTestCase):
+    def _save_timers(self, writer, count):
+        for i in range(count):
+            confighandler.save_timer(
+                STimer(duration=i + 1, name="w{}_{}".format(writer, i))
+            )
+
+    def test_parallel_writers_lose_nothing(self):
+        context = multiprocessing.get_context("fork")
+        confighandler.get_defaults()
+        writers = [
+            context.Process(target=self._save_timers, args=(writer, 20))
+            for writer in range(6)
+        ]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join(30)
+            self.assertEqual(writer.exitcode, 0)
+        confighandler._config_cache["key"] = None
+        self.assertEqual(len(confighandler.get_timers_list()), 120)
+
+    def _hold_lock(self):
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with confighandler.file_lock(confighandler.CONFIG_FILE):
+                locked.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        locked.wait(5)
+        return thread, release
+
+    def test_bounded_wait(self):
+        thread, release = self._hold_lock()
+        with mock.patch.object(confighandler, "LOCK_TIMEOUT", 0.05):
+            with self.assertRaises(TimeoutError):
+                confighandler.write_value("up", "true")
+            # Readers wait for writers too.
+            with self.assertRaises(TimeoutError):
+                with confighandler.file_lock(confighandler.CONFIG_FILE, False):
+                    pass
+        release.set()
+        thread.join()
+        confighandler.write_value("up", "true")
+        self.assertEqual(confighandler.read_value("up"), "true")
+
+    def test_reader_timeout_raises(self):
+        confighandler.write_value("up", "true")
+        confighandler._config_cache["key"] = None
+        self._hold_lock()
+        with mock.patch.object(confighandler, "LOCK_TIMEOUT", 0.05):
+            with self.assertRaises(TimeoutError):
+                confighandler.read_value("up")
+
+    def test_forked_child_releases_locks(self):
+        read_fd, write_fd = os.pipe()
+        with confighandler.config_batch():
+            pid = os.fork()
+            if pid == 0:
+                # Stands in for the daemon: outlives the parent's batch.
+                confighandler.release_locks_after_fork()
+                os.close(write_fd)
+                os.read(read_fd, 1)
+                os._exit(0 if confighandler._config_batch["depth"] == 0 else 1)
+        os.close(read_fd)
+        try:
+            with mock.patch.object(confighandler, "LOCK_TIMEOUT", 0.5):
+                confighandler.write_value("up", "true")
+        finally:
+            os.close(write_fd)
+            self.assertEqual(os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]), 0)
+
+    def test_prompt_outside_lock(self):
+        confighandler.save_timer(STimer(duration=5, name="tea"))
+
+        def answer(prompt):
+            # Another process can still write while the prompt is open.
+            self.assertFalse(getattr(confighandler._held_locks, "locks", None))
+            return "Y"
+
+        with mock.patch("builtins.input", side_effect=answer) as prompt:
+            confighandler.save_timer(STimer(duration=7, name="tea"))
+        prompt.assert_called_once()
+        self.assertEqual(confighandler.load_timer("tea").duration(), 7)
+
+    def test_name_taken_after_check(self):
+        store = confighandler._timer_store()
+        real_contains = type(store).__contains__
+        calls = []
+
+        def contains(self, name):
+            # Unsaved at the unlocked check, taken by the time the lock is held.
+            calls.append(name)
+            return len(calls) > 1 and real_contains(self, name)
+
+        confighandler.save_timer(STimer(duration=5, name="tea"))
+        with mock.patch.object(type(store), "__contains__", contains):
+            self.assertIsNone(confighandler.save_timer(STimer(duration=7, name="tea")))
+        self.assertEqual(confighandler.load_timer("tea").duration(), 5)
+
+    def test_reentrant(self):
+        with confighandler.file_lock(confighandler.CONFIG_FILE):
+            with confighandler.config_batch():
+                confighandler.write_value("up", "true")
+            confighandler.save_timer(STimer(duration=5))
+        self.assertEqual(confighandler.load_timer("1").duration(), 5)
+
+
+class TestIterTimers(ConfigTestCase):
+    NAMES = ["tea", "Tea2", "eggs", "pasta", "t*x"]
+
+    def _names(self, match):
+        return [name for name, timer in confighandler.iter_timers(match)]
+
+    def _check_filters(self):
+        confighandler.import_timers(
+            json.dumps({"name": name, "duration": 5}) for name in self.NAMES
+        )
+        self.assertEqual(self._names(None), ["tea", "tea2", "eggs", "pasta", "t*x"])
+        self.assertEqual(self._names("TE"), ["tea", "tea2"])
+        self.assertEqual(self._names("*a"), ["tea", "pasta"])
+        self.assertEqual(self._names("t?a*"), ["tea", "tea2"])
+        self.assertEqual(self._names("[!t]*"), ["eggs", "pasta"])
+        self.assertEqual(self._names("t[*]*"), ["t*x"])
+        self.assertEqual(self._names("nothing"), [])
+
+    def test_config_store(self):
+        self._check_filters()
+
+    @unittest.skipUnless(confighandler.SQLITE_AVAILABLE, "sqlite3 not available")
+    def test_sqlite_store(self):
+        confighandler.write_value("timer_store", '"sqlite"')
+        self._check_filters()
+
+
+class TestImportExport(ConfigTestCase):
+    def test_round_trip_single_write(self):
+        lines = [
+            STimer(duration=i + 1, name="t" + str(i)).to_json() for i in range(500)
+        ]
+        lines.append(json.dumps({"duration": 5.5, "up": True}))
+        with mock.patch.object(
+            confighandler, "_replace_file", wraps=confighandler._replace_file
+        ) as replace_file:
+            counts = confighandler.import_timers(lines)
+        # Defaults and timers all go out in the same write.
+        self.assertEqual(replace_file.call_count, 1)
+        self.assertEqual(counts["imported"], 501)
+        self.assertEqual(confighandler.load_timer("t42").duration(), 43)
+        self.assertTrue(confighandler.load_timer("1").up)
+        buffer = io.StringIO()
+        self.assertEqual(confighandler.export_timers(buffer), 501)
+        exported = [json.loads(line) for line in buffer.getvalue().splitlines()]
+        self.assertEqual(exported[0]["name"], "t0")
+        self.assertEqual(exported[-1]["name"], "1")
+        self.assertEqual(exported[-1]["duration"], 5.5)
+
+    def test_duplicates(self):
+        confighandler.save_timer(STimer(duration=5, name="tea"))
+        lines = ['{"name": "Tea", "duration": 6}', '{"name": "eggs", "duration": 7}']
+        counts = confighandler.import_timers(lines)
+        self.assertEqual((counts["imported"], counts["skipped"]), (1, 1))
+        self.assertEqual(confighandler.load_timer("tea").duration(), 5)
+        counts = confighandler.import_timers(lines, overwrite=True)
+        self.assertEqual((counts["imported"], counts["overwritten"]), (2, 2))
+        self.assertEqual(confighandler.load_timer("tea").duration(), 6)
+
+    def test_invalid_lines(self):
+        lines = [
+            "not json",
+            "[5]",
+            '{"duration": -1}',
+            '{"duration": "5"}',
+            '{"duration": 5, "color": "red"}',
+            '{"duration": 5, "name": "a=b"}',
+            '{"duration": 5, "precision": -2}',
+            "",
+            '{"duration": 5, "name": "ok"}',
+        ]
+        with self.assertLogs(level="WARNING"):
+            counts = confighandler.import_timers(lines)
+        self.assertEqual((counts["imported"], counts["invalid"]), (1, 7))
+        self.assertEqual(
+            [name for name, timer in confighandler.get_timers_list()], ["ok"]
+        )
+
+    def test_save_rejects_unimportable_names(self):
+        # Saving and importing agree on which names round-trip.
+        for name in ("a=b", "a:b", " tea", "tea\n"):
+            with self.assertLogs(level="ERROR"):
+                self.assertIsNone(
+                    confighandler.save_timer(STimer(duration=5, name=name))
+                )
+        self.assertEqual(confighandler.get_timers_list(), [])
+
+    @unittest.skipUnless(confighandler.SQLITE_AVAILABLE, "sqlite3 not available")
+    def test_sqlite(self):
+        confighandler.write_value("timer_store", '"sqlite"')
+        confighandler.save_timer(STimer(duration=5))
+        counts = confighandler.import_timers(['{"duration": 6}', '{"name": "1"}'])
+        self.assertEqual((counts["imported"], counts["skipped"]), (1, 1))
+        names = [name for name, timer in confighandler.get_timers_list()]
+        self.assertEqual(names, ["1", "2"])
+
+    def _check_one_meta_write(self):
+        store = confighandler._timer_store()
+        lines = [json.dumps({"duration": i + 1}) for i in range(200)]
+        with mock.patch.object(
+            type(store), "put_meta", wraps=store.put_meta
+        ) as put_meta, mock.patch.object(
+            type(store), "put_many", wraps=store.put_many
+        ) as put_many:
+            counts = confighandler.import_timers(lines)
+        self.assertEqual(counts["imported"], 200)
+        # The counter goes out with the timers, not once per numbered timer.
+        put_meta.assert_not_called()
+        self.assertEqual(put_many.call_count, 1)
+        self.assertIn(confighandler.TIMER_NUMBERS_KEY, put_many.call_args[0][1])
+        self.assertEqual(confighandler._find_timer_number(), "201")
+
+    def test_numbering_single_meta_write(self):
+        self._check_one_meta_write()
+
+    @unittest.skipUnless(confighandler.SQLITE_AVAILABLE, "sqlite3 not available")
+    def test_numbering_single_meta_write_sqlite(self):
+        confighandler.write_value("timer_store", '"sqlite"')
+        self._check_one_meta_write()
+
+
+class TestRunningTimers(ConfigTestCase):
+    def _dead_pid(self):
+        process = subprocess.Popen([sys.executable, "-c", ""])
+        process.wait()
+        return process.pid
+
+    def test_record_and_clear(self):
+        timer = STimer(duration=60)
+        timer.start()
+        entry_ids = confighandler.record_running([("tea", timer)])
+        entries = confighandler.get_running_timers()
+        self.assertEqual([entry["id"] for entry in entries], entry_ids)
+        self.assertEqual(entries[0]["label"], "tea")
+        confighandler.clear_running(entry_ids)
+        self.assertEqual(confighandler.get_running_timers(), [])
+        self.assertFalse(Path(self.tmp_dir.name, "running.json").exists())
+
+    def test_orphans_resume_from_wall_clock(self):
+        timer = STimer(duration=60)
+        timer.start()
+        entry = confighandler.running_entry("tea", timer)
+        entry["pid"] = self._dead_pid()
+        entry["started_at_ns"] = time.time_ns() - 20 * 10**9
+        live = confighandler.running_entry("eggs", timer)
+        confighandler.update_running(add=[entry, live])
+        orphans = confighandler.get_orphaned_timers("terminal")
+        self.assertEqual([orphan["id"] for orphan in orphans], [entry["id"]])
+        self.assertEqual(confighandler.get_orphaned_timers("daemon"), [])
+        resumed = confighandler.resume_running(orphans[0])
+        self.assertEqual(resumed.duration(), 60)
+        self.assertAlmostEqual(resumed.elapsed(), 20, delta=1)
+
+    def test_no_writes_without_transitions(self):
+        with mock.patch.object(confighandler, "_replace_file") as replace_file:
+            confighandler.clear_running(["missing"])
+            confighandler.record_running([])
+        self.assertEqual(replace_file.call_count, 0)
+
+    def test_corrupt_file_ignored(self):
+        Path(self.tmp_dir.name, "running.json").write_text("[{")
+        self.assertEqual(confighandler.get_running_timers(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from stimer import confighandler
+from stimer.client import DaemonClient
+from stimer.core import STimer
+from stimer.daemon import STimerDaemon
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        socket_path = self.tmp_dir.name + "/stimer.sock"
+        patch = mock.patch.object(confighandler, "CONFIG_DIR", self.tmp_dir.name + "/")
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.daemon = STimerDaemon(socket_path)
+        self.client = DaemonClient(socket_path)
+        thread = threading.Thread(target=asyncio.run, args=(self.daemon.serve(),))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.client.shutdown)
+        for _ in range(500):
+            if self.client.running():
+                break
+            threading.Event().wait(0.01)
+
+    def test_start_list_cancel(self):
+        first = self.client.start(STimer(duration=600), label="tea")
+        second = self.client.start(STimer(up=True))
+        self.assertTrue(first["ok"])
+        timers = self.client.list()["timers"]
+        self.assertEqual([info["label"] for info in timers], ["tea", "stopwatch"])
+        self.assertEqual(timers[0]["remaining"], "00:10:00")
+        self.assertTrue(self.client.cancel(first["id"])["ok"])
+        self.assertFalse(self.client.cancel(first["id"])["ok"])
+        self.assertEqual(self.client.list()["timers"][0]["id"], second["id"])
+
+    def test_get_resumes_elapsed(self):
+        timer_id = self.client.start(STimer(duration=600))["id"]
+        response = self.client.get(timer_id)
+        timer = STimer.from_json(response["timer"])
+        timer.start(response["elapsed_ns"])
+        self.assertEqual(timer.duration(), 600)
+        self.assertGreaterEqual(timer.elapsed_ns(), response["elapsed_ns"])
+
+    def test_expired_timers_removed(self):
+        self.client.start(STimer(duration=0.05))
+        threading.Event().wait(0.2)
+        self.assertEqual(self.client.request("ping")["timers"], 0)
+
+    def test_running_file_follows_transitions(self):
+        timer_id = self.client.start(STimer(duration=600), label="tea")["id"]
+        self.client.request("ping")
+        entries = confighandler.get_running_timers()
+        self.assertEqual([entry["label"] for entry in entries], ["tea"])
+        self.assertEqual(entries[0]["owner"], "daemon")
+        self.client.cancel(timer_id)
+        self.client.request("ping")
+        self.assertEqual(confighandler.get_running_timers(), [])
+
+    def test_bad_requests(self):
+        self.assertFalse(self.daemon.handle_request(b"not json")["ok"])
+        self.assertFalse(self.daemon.handle_request(b'{"cmd": "reboot"}')["ok"])
+        request = json.dumps({"cmd": "start", "timer": json.dumps({"up": False})})
+        self.assertFalse(self.daemon.handle_request(request)["ok"])
+
+
+class TestDaemonRestore(unittest.TestCase):
+    def test_restores_orphaned_timers(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with mock.patch.object(confighandler, "CONFIG_DIR", tmp_dir + "/"):
+                timer = STimer(duration=600)
+                timer.start()
+                entry = confighandler.running_entry("tea", timer, owner="daemon")
+                process = subprocess.Popen([sys.executable, "-c", ""])
+                process.wait()
+                entry["pid"] = process.pid
+                confighandler.update_running(add=[entry])
+                daemon = STimerDaemon(tmp_dir + "/stimer.sock")
+
+                async def restore():
+                    daemon._restore()
+                    await asyncio.sleep(0)
+                    return daemon._list({})["timers"]
+
+                timers = asyncio.run(restore())
+                entries = confighandler.get_running_timers()
+        self.assertEqual([info["label"] for info in timers], ["tea"])
+        self.assertEqual(len(entries), 1)
+        self.assertNotEqual(entries[0]["id"], entry["id"])
+
+
+class TestDaemonClient(unittest.TestCase):
+    def test_not_running(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            client = DaemonClient(tmp_dir + "/stimer.sock")
+            self.assertFalse(client.running())
+            self.assertIsNone(client.list())
+
+
+if __name__ == "__main__":
+    unittest.main()
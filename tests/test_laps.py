@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from stimer.core import ManualClock, STimer
+from stimer.laps import LapReader, LapRecorder, load_laps
+
+
+class TestLapRecorder(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def record(self, recorder, splits):
+        for split_ns in splits:
+            recorder.add(split_ns)
+        recorder.close()
+
+    def test_stats(self):
+        recorder = LapRecorder()
+        self.assertIsNone(recorder.mean_ns())
+        self.record(recorder, [300, 400, 1000, 1200])
+        self.assertEqual(list(recorder.laps_ns), [300, 100, 600, 200])
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(recorder.min_ns, 100)
+        self.assertEqual(recorder.max_ns, 600)
+        self.assertEqual(recorder.mean_ns(), 300)
+
+    def test_csv_streaming(self):
+        path = self.tmp_dir.name + "/laps.csv"
+        recorder = LapRecorder(path, buffer_laps=3)
+        self.record(recorder, [i * i * 1000 for i in range(1, 11)])
+        # Flushed laps leave memory; the statistics keep covering all of them.
+        self.assertEqual(len(recorder.laps_ns), 0)
+        self.assertEqual(recorder.count, 10)
+        self.assertEqual(recorder.max_ns, 19000)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], "lap,lap_ns,split_ns")
+        self.assertEqual(lines[4], "4,7000,16000")
+        self.assertEqual(lines[10], "10,19000,100000")
+        self.assertEqual(
+            list(load_laps(path)), [(2 * i - 1) * 1000 for i in range(1, 11)]
+        )
+
+    def test_binary_streaming(self):
+        path = self.tmp_dir.name + "/laps.bin"
+        recorder = LapRecorder(path, buffer_laps=4)
+        self.record(recorder, range(5, 55, 5))
+        self.assertEqual(os.path.getsize(path), 80)
+        self.assertEqual(list(load_laps(path)), [5] * 10)
+
+    def test_summary(self):
+        recorder = LapRecorder()
+        self.assertEqual(recorder.summary(), "No laps recorded.")
+        self.record(recorder, [1500000000, 2000000000])
+        self.assertEqual(
+            recorder.summary(3).splitlines(),
+            [
+                "Laps: 2",
+                "  min  00:00:00.500",
+                "  mean 00:00:01.000",
+                "  max  00:00:01.500",
+            ],
+        )
+
+
+class TestTimerLaps(unittest.TestCase):
+    def test_lap(self):
+        clock = ManualClock()
+        timer = STimer(clock=clock, up=True)
+        timer.start()
+        clock.advance(1.5)
+        self.assertEqual(timer.lap(), 1500000000)
+        clock.advance(0.25)
+        self.assertEqual(timer.lap(), 250000000)
+        self.assertEqual(timer.laps.count, 2)
+        self.assertEqual(timer.laps.last_split_ns, 1750000000)
+
+    def test_reader_counts_lines(self):
+        timer = STimer(up=True)
+        timer.start()
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(read_fd) as stream, mock.patch("stimer.laps.os.kill") as kill:
+            reader = LapReader(timer, stream)
+            reader.start()
+            os.write(write_fd, b"a\nb\nc\n")
+            os.close(write_fd)
+            reader._thread.join(5)
+            reader.stop()
+        self.assertEqual(timer.laps.count, 3)
+        # End of input stops the timer like Ctrl-C.
+        kill.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import contextlib
+import io
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from stimer import __main__ as cli
+from stimer import confighandler
+
+
+class CLITestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        config_dir = self.tmp_dir.name + "/"
+        patches = [
+            mock.patch.object(confighandler, "CONFIG_DIR", config_dir),
+            mock.patch.object(
+                confighandler, "CONFIG_FILE", Path(config_dir + "stimer.conf")
+            ),
+            mock.patch.dict(confighandler._config_cache, {"key": None}),
+            mock.patch.dict(confighandler._timer_stores, clear=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def parse_args(self, argv):
+        with mock.patch.object(sys, "argv", ["stimer"] + argv), mock.patch.object(
+            cli, "parse"
+        ) as parse:
+            with self.assertRaises(SystemExit):
+                cli.main()
+        return parse.call_args[0][0]
+
+
+class TestBuildTimers(CLITestCase):
+    def test_name_labels_timer(self):
+        args = self.parse_args(["10m", "-n", "tea"])
+        labeled_timers = cli.build_timers(args, [], args.duration)
+        self.assertEqual([label for label, timer in labeled_timers], ["tea"])
+
+    def test_duration_labels_unnamed(self):
+        args = self.parse_args(["10m", "5m"])
+        labeled_timers = cli.build_timers(args, [], args.duration)
+        self.assertEqual([label for label, timer in labeled_timers], ["10m", "5m"])
+
+
+class TestRunningRecord(CLITestCase):
+    def run_timer(self, argv):
+        confighandler.get_defaults()
+        replace_file = mock.patch.object(
+            confighandler, "_replace_file", wraps=confighandler._replace_file
+        )
+        with mock.patch.object(sys, "argv", ["stimer", "-a", "--json"] + argv):
+            with mock.patch("stimer.output.STimerOutput.start_output"):
+                with replace_file as replace, contextlib.redirect_stdout(io.StringIO()):
+                    with self.assertRaises(SystemExit):
+                        cli.main()
+        return replace.call_count
+
+    def test_short_run_not_recorded(self):
+        self.assertEqual(self.run_timer(["2"]), 0)
+
+    def test_long_run_recorded(self):
+        self.assertEqual(self.run_timer(["10m"]), 1)
+        self.assertEqual(confighandler.get_running_timers(), [])
+
+
+class TestLaps(CLITestCase):
+    def test_countdown_rejected(self):
+        buffer = io.StringIO()
+        with mock.patch.object(sys, "argv", ["stimer", "5", "--laps"]):
+            with mock.patch.object(cli, "record_running") as record_running:
+                with contextlib.redirect_stdout(buffer), self.assertRaises(SystemExit):
+                    cli.main()
+        self.assertIn('"UP" (stopwatch) mode', buffer.getvalue())
+        record_running.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
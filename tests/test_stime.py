@@ -1,6 +1,31 @@
 import unittest
 
-from stimer.core import STimeData, STimer, parse_duration
+import asyncio
+import contextlib
+import io
+import json
+import os
+import pty
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from stimer.core import (
+    DurationParseError,
+    ManualClock,
+    MonotonicClock,
+    NS_PER_SEC,
+    NUMPY_AVAILABLE,
+    STimeData,
+    STimer,
+    clock_batch,
+    parse_duration,
+)
+from stimer.engine import STimerEngine
+from stimer.output import ANSIRenderer, OutputStats, STimerOutput, TickScheduler
+from stimer.plan import compile_plan
 
 
 class TestSTimeDataClock(unittest.TestCase):
@@ -64,6 +89,74 @@ class TestSTimeDataClock(unittest.TestCase):
         clock_fmt = stime_data.clock(3)
         self.assertEqual(clock_fmt, "02:11:20.166")
 
+    def test_clock_carry_mins(self):
+        stime_data = STimeData(59.9996)
+        clock_fmt = stime_data.clock(3)
+        self.assertEqual(clock_fmt, "00:01:00.000")
+
+    def test_clock_carry_hours(self):
+        stime_data = STimeData(3599.6)
+        clock_fmt = stime_data.clock()
+        self.assertEqual(clock_fmt, "01:00:00")
+
+    def test_clock_hundreds_hours(self):
+        stime_data = STimeData(360005.25)
+        clock_fmt = stime_data.clock(2)
+        self.assertEqual(clock_fmt, "100:00:05.25")
+
+
+class TestClockBatch(unittest.TestCase):
+    SECONDS = [
+        0,
+        24,
+        34.125,
+        59.9996,
+        82.133,
+        905.1,
+        3599.6,
+        4599.55,
+        7880.16561,
+        360005.25,
+        0.125,
+        2.675,
+        1e-7,
+    ]
+
+    def values(self):
+        return self.SECONDS + [i * 7.123457 for i in range(200)]
+
+    def assert_matches_clock(self, values, result, precision):
+        expected = [STimeData(value).clock(precision) for value in values]
+        self.assertEqual(result, expected)
+
+    def test_python(self):
+        values = self.values()
+        with mock.patch("stimer.core.NUMPY_AVAILABLE", False):
+            for precision in (None, 0, 1, 2, 3, 12):
+                result = clock_batch(values, precision)
+                self.assert_matches_clock(values, result, precision)
+
+    @unittest.skipUnless(NUMPY_AVAILABLE, "numpy is not installed")
+    def test_numpy(self):
+        import numpy
+
+        values = self.values()
+        for precision in (None, 0, 1, 2, 3):
+            result = clock_batch(numpy.array(values), precision)
+            self.assert_matches_clock(values, result, precision)
+
+    @unittest.skipUnless(NUMPY_AVAILABLE, "numpy is not installed")
+    def test_numpy_falls_back_for_large_values(self):
+        values = self.values() + [1e12]
+        result = clock_batch(values, 12)
+        self.assert_matches_clock(values, result, 12)
+
+    def test_short_and_empty(self):
+        self.assertEqual(clock_batch([], 2), [])
+        self.assertEqual(
+            clock_batch([59.9996, 82.133], 3), ["00:01:00.000", "00:01:22.133"]
+        )
+
 
 class TestParseDuration(unittest.TestCase):
     def test_char_secs(self):
@@ -144,6 +237,42 @@ class TestParseDuration(unittest.TestCase):
     def test_invalid_clock_nondigit_hms(self):
         self.assertIsNone(parse_duration("a:b:c"))
 
+    def test_char_blank_units(self):
+        self.assertEqual(parse_duration("3hm1s"), 10801.0)
+
+    def test_char_trailing_secs(self):
+        self.assertEqual(parse_duration("4m12"), 252.0)
+
+    def test_invalid_char_extra_dot(self):
+        self.assertIsNone(parse_duration("1.2.3h"))
+
+    def test_invalid_clock_extra_dot(self):
+        self.assertIsNone(parse_duration("1..2"))
+
+    def test_invalid_mixed_formats(self):
+        self.assertIsNone(parse_duration("1h:30"))
+
+    def test_error_position(self):
+        with self.assertRaises(DurationParseError) as cm:
+            parse_duration("5h1m22s7t", strict=True)
+        self.assertEqual(cm.exception.position, 8)
+
+    def test_error_position_clock(self):
+        with self.assertRaises(DurationParseError) as cm:
+            parse_duration("5:1:124:6", strict=True)
+        self.assertEqual(cm.exception.position, 7)
+
+    def test_pathological_linear(self):
+        # CPU time, so a busy machine does not count against the parser. The
+        # linear parser takes well under a second; backtracking over 100000
+        # characters would take hours, so the bound can be very loose.
+        start = time.process_time()
+        self.assertIsNone(parse_duration("1" * 100000 + "a"))
+        self.assertIsNone(parse_duration("1" * 100000 + ":1:1:1"))
+        self.assertIsNone(parse_duration("1." * 100000))
+        self.assertEqual(parse_duration("1h" * 100000), 360000000.0)
+        self.assertLess(time.process_time() - start, 60)
+
 
 class TestSTimer(unittest.TestCase):
     def test_precision_whole(self):
@@ -170,6 +299,473 @@ class TestSTimer(unittest.TestCase):
         stimer.option_dict = options
         self.assertEqual(stimer.precision, 0)
 
+    def test_manual_clock_elapsed(self):
+        clock = ManualClock()
+        stimer = STimer(clock=clock, duration=3600)
+        stimer.start()
+        clock.advance(1234.5)
+        self.assertEqual(stimer.elapsed(), 1234.5)
+        self.assertEqual(stimer.remaining(), 2365.5)
+
+    def test_manual_clock_elapsed_capped(self):
+        clock = ManualClock()
+        stimer = STimer(clock=clock, duration=60)
+        stimer.start()
+        clock.sleep(90)
+        self.assertEqual(stimer.elapsed(), 60)
+        self.assertEqual(stimer.remaining(), 0)
+
+
+class TestPreciseExpiry(unittest.TestCase):
+    def test_sleep_until_deadline(self):
+        now = [1000000000]
+
+        def monotonic_ns():
+            now[0] = now[0] + 100000
+            return now[0]
+
+        def sleep(seconds):
+            # Wakes half a millisecond late, well inside the spin window.
+            now[0] = now[0] + int(seconds * 1e9) + 500000
+
+        clock = MonotonicClock()
+        with mock.patch("stimer.core.time.monotonic_ns", monotonic_ns), mock.patch(
+            "stimer.core.time.sleep", side_effect=sleep
+        ) as slept:
+            deadline_ns = clock.now_ns() + 20000000
+            fired_ns = clock.sleep_until_ns(deadline_ns, spin_ns=2000000)
+        slept.assert_called_once()
+        self.assertAlmostEqual(slept.call_args[0][0], 0.0179, places=6)
+        self.assertGreaterEqual(fired_ns, deadline_ns)
+        # Spinning stops on the first clock reading past the deadline.
+        self.assertLessEqual(fired_ns - deadline_ns, 100000)
+
+    def test_deadline_counts_as_expired(self):
+        clock = ManualClock()
+        for duration in (0.1, 0.3, 1.7, 59.99, 12345.678):
+            stimer = STimer(clock=clock, duration=duration)
+            stimer.start()
+            clock.sleep_until_ns(stimer.deadline_ns())
+            self.assertTrue(stimer.snapshot().expired)
+            self.assertEqual(stimer.snapshot().remaining, 0)
+
+    def test_output_reports_error(self):
+        clock = ManualClock()
+        stimer = STimer(clock=clock, duration=2.5)
+        stimer.start()
+        with mock.patch(
+            "stimer.output.get_defaults", return_value=TestSTimerEngine.DEFAULTS
+        ):
+            output = STimerOutput(stimer, renderer="json", precise=True)
+        buffer = io.StringIO()
+        with contextlib.redirect_stdout(buffer):
+            output.start_output()
+        expired = json.loads(buffer.getvalue().splitlines()[-1])
+        self.assertEqual(output.expiry_error_ns, 0)
+        self.assertEqual(expired["error_ms"], 0)
+        self.assertEqual(clock.now_ns(), stimer.deadline_ns())
+
+
+class TestSTimerSnapshot(unittest.TestCase):
+    def test_snapshot_values(self):
+        clock = ManualClock()
+        stimer = STimer(clock=clock, duration=90.5)
+        stimer.start()
+        clock.advance(30.25)
+        snap = stimer.snapshot()
+        self.assertEqual(snap.elapsed, 30.25)
+        self.assertEqual(snap.remaining, 60.25)
+        self.assertEqual(snap.elapsed_clock, "00:00:30.2")
+        self.assertEqual(snap.remaining_clock, "00:01:00.2")
+        self.assertEqual(snap.duration_clock, "00:01:30.5")
+        self.assertFalse(snap.expired)
+
+    def test_snapshot_frozen(self):
+        clock = ManualClock()
+        stimer = STimer(clock=clock, duration=10)
+        stimer.start()
+        snap = stimer.snapshot()
+        clock.advance(20)
+        self.assertEqual(snap.elapsed, 0)
+        self.assertTrue(stimer.snapshot().expired)
+        with self.assertRaises(AttributeError):
+            snap.elapsed = 5
+
+    def test_snapshot_no_duration(self):
+        clock = ManualClock()
+        stimer = STimer(clock=clock, up=True)
+        stimer.start()
+        clock.advance(65)
+        snap = stimer.snapshot()
+        self.assertIsNone(snap.remaining)
+        self.assertIsNone(snap.remaining_clock)
+        self.assertEqual(snap.elapsed_clock, "00:01:05")
+
+
+class TestTimerPlan(unittest.TestCase):
+    DEFAULTS = {
+        "up": False,
+        "sound": True,
+        "widget_fmt": "full",
+        "precision": 1,
+        "max_fps": 30,
+        "renderer": "native",
+        "stream_interval": 10,
+        "precise_expiry": False,
+    }
+
+    def test_resolves_defaults(self):
+        plan = compile_plan(STimer(duration=90), self.DEFAULTS)
+        self.assertEqual(plan.duration, 90)
+        self.assertEqual(plan.duration_ns, 90 * 10**9)
+        self.assertFalse(plan.up)
+        self.assertTrue(plan.sound)
+        self.assertEqual(plan.precision, 0)
+        self.assertEqual(plan.widgets, ("remaining", "bar", "elapsed"))
+        self.assertEqual(plan.bar_max_value, 90)
+
+    def test_timer_and_overrides_win(self):
+        stimer = STimer(duration=1.25, up=True, sound=False, widget_fmt="simple")
+        plan = compile_plan(stimer, self.DEFAULTS, max_fps=5, renderer="json")
+        self.assertTrue(plan.up)
+        self.assertFalse(plan.sound)
+        self.assertEqual(plan.precision, 2)
+        self.assertEqual(plan.widgets, ("elapsed",))
+        self.assertEqual(plan.max_fps, 5)
+        self.assertEqual(plan.renderer, "json")
+
+    def test_stopwatch_uses_default_precision(self):
+        plan = compile_plan(STimer(up=True), self.DEFAULTS)
+        self.assertEqual(plan.precision, 1)
+        self.assertEqual(plan.widgets, ("elapsed",))
+        self.assertEqual(plan.snapshot(1500000000).elapsed_clock, "00:00:01.5")
+
+    def test_immutable(self):
+        plan = compile_plan(STimer(duration=5), self.DEFAULTS)
+        with self.assertRaises(AttributeError):
+            plan.precision = 3
+
+    def test_output_uses_plan(self):
+        plan = compile_plan(STimer(duration=5), self.DEFAULTS)
+        with mock.patch("stimer.output.get_defaults") as get_defaults:
+            output = STimerOutput(STimer(duration=5), plan=plan)
+        get_defaults.assert_not_called()
+        self.assertIs(output.plan, plan)
+
+
+class TestSTimerAsync(unittest.TestCase):
+    def run_on_clock(self, clock, coro):
+        # The event loop's clock is the timer's ManualClock, and sleeping
+        # advances it to the wake-up time at once.
+        async def sleep_at(loop, when):
+            clock.advance_ns(max(round((when - loop.time()) * NS_PER_SEC), 1))
+
+        async def run():
+            asyncio.get_running_loop().time = lambda: clock.now_ns() / NS_PER_SEC
+            return await coro()
+
+        with mock.patch("stimer.core._sleep_at", sleep_at):
+            return asyncio.run(run())
+
+    def test_wait(self):
+        clock = ManualClock()
+        stimer = STimer(clock=clock, duration=0.05)
+        stimer.start()
+        snap = self.run_on_clock(clock, stimer.wait)
+        self.assertTrue(snap.expired)
+        self.assertEqual(snap.remaining, 0)
+        self.assertEqual(clock.now_ns(), stimer.deadline_ns())
+
+    def test_wait_many(self):
+        timers = [STimer(duration=0.01 * (i % 5 + 1)) for i in range(500)]
+
+        async def wait_all():
+            for stimer in timers:
+                stimer.start()
+            return await asyncio.gather(*(stimer.wait() for stimer in timers))
+
+        self.assertTrue(all(snap.expired for snap in asyncio.run(wait_all())))
+
+    def test_wait_not_started(self):
+        with self.assertRaises(RuntimeError):
+            asyncio.run(STimer(duration=1).wait())
+
+    def test_ticks(self):
+        clock = ManualClock()
+        stimer = STimer(clock=clock, duration=0.25)
+
+        async def collect():
+            stimer.start()
+            return [snap async for snap in stimer.ticks(0.1)]
+
+        snaps = self.run_on_clock(clock, collect)
+        self.assertEqual(
+            [snap.elapsed_ns for snap in snaps], [0, 100000000, 200000000, 250000000]
+        )
+        self.assertTrue(snaps[-1].expired)
+
+
+class TestTickScheduler(unittest.TestCase):
+    def test_next_boundary(self):
+        scheduler = TickScheduler([(1, 0.5)])
+        self.assertAlmostEqual(scheduler.next_tick(0.7), 1.5, places=5)
+
+    def test_nearest_step(self):
+        scheduler = TickScheduler([(1, 0.5), (0.25, 0)])
+        self.assertAlmostEqual(scheduler.next_tick(0.6), 0.75, places=5)
+
+    def test_max_fps(self):
+        scheduler = TickScheduler([(0.01, 0)], max_fps=10)
+        self.assertAlmostEqual(scheduler.next_tick(1.0), 1.1)
+
+    def test_deadline(self):
+        scheduler = TickScheduler([(1, 0.5)], deadline=1.2)
+        self.assertEqual(scheduler.next_tick(1.1), 1.2)
+
+
+class TestANSIRenderer(unittest.TestCase):
+    def _renderer(self, fd, **kwargs):
+        renderer = ANSIRenderer(
+            ["remaining", "bar", "elapsed"],
+            max_value=10,
+            variables={"remaining": "00:00:10", "elapsed": "00:00:00"},
+            fd=fd,
+            **kwargs
+        )
+        renderer.term_width = 30
+        return renderer
+
+    def test_layout(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        renderer = self._renderer(write_fd)
+        line = renderer.render(5)
+        self.assertEqual(len(line), 30)
+        self.assertEqual(line, "00:00:10 " + "\u2588" * 6 + " " * 6 + " 00:00:00")
+
+    def test_line_breaks_when_not_tty(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        renderer = self._renderer(write_fd)
+        renderer.update(0)
+        renderer.update(0)
+        renderer.update(10, remaining="00:00:00", elapsed="00:00:10")
+        renderer.finish()
+        lines = os.read(read_fd, 4096).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("00:00:00 " + "\u2588" * 12))
+
+    def test_redraws_changed_span(self):
+        master_fd, slave_fd = pty.openpty()
+        self.addCleanup(os.close, master_fd)
+        self.addCleanup(os.close, slave_fd)
+        renderer = self._renderer(slave_fd)
+        renderer.update(0)
+        os.read(master_fd, 4096)
+        renderer.update(0, elapsed="00:00:01")
+        data = os.read(master_fd, 4096)
+        renderer.update(5, remaining="00:00:05")
+        data_bar = os.read(master_fd, 4096)
+        renderer.finish()
+        self.assertEqual(data, b"\x1b[30G1")
+        self.assertEqual(data_bar, "\x1b[7G05\x1b[10G{}".format("\u2588" * 6).encode())
+
+    def test_write_uses_fd_encoding(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        stream = open(write_fd, "w", encoding="latin-1", closefd=False)
+        self.addCleanup(stream.close)
+        real_write = os.write
+
+        def short_write(fd, data):
+            return real_write(fd, data[:2])
+
+        with mock.patch("stimer.output.sys.stdout", stream):
+            renderer = self._renderer(write_fd)
+        with mock.patch("stimer.output.os.write", side_effect=short_write):
+            renderer._write("\u00e9\u2588abc")
+        self.assertEqual(renderer.encoding, "latin-1")
+        self.assertEqual(os.read(read_fd, 4096), b"\xe9?abc")
+
+
+class TestSTimerEngine(unittest.TestCase):
+    DEFAULTS = {
+        "up": False,
+        "sound": False,
+        "widget_fmt": "simple",
+        "precision": 0,
+        "max_fps": 30,
+        "renderer": "native",
+        "stream_interval": 10,
+        "precise_expiry": False,
+    }
+
+    def setUp(self):
+        patches = [
+            mock.patch("stimer.output.get_defaults", return_value=self.DEFAULTS),
+            mock.patch("stimer.engine.alert"),
+        ]
+        for patch in patches:
+            self.alert = patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_runs_timers_to_expiry(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        clock = ManualClock()
+        engine = STimerEngine(clock=clock, fd=write_fd)
+        engine.add(STimer(duration=2), label="tea")
+        engine.add(STimer(duration=3))
+        engine.run()
+        lines = os.read(read_fd, 4096).decode().split("\n")
+        self.assertEqual(lines[:2], ["tea 00:00:02", "#2  00:00:03"])
+        self.assertEqual(lines[-3:], ["#2  00:00:01", "#2  00:00:00", ""])
+        self.assertEqual(lines.count("tea 00:00:00"), 1)
+        self.assertAlmostEqual(clock.now_ns() / 1e9, 3.0, places=5)
+        self.alert.assert_called_once_with(False)
+
+    def test_rows_addressed_on_terminal(self):
+        master_fd, slave_fd = pty.openpty()
+        self.addCleanup(os.close, master_fd)
+        self.addCleanup(os.close, slave_fd)
+        engine = STimerEngine(clock=ManualClock(), fd=slave_fd)
+        engine.add(STimer(duration=1), label="a")
+        engine.add(STimer(duration=5), label="b")
+        self.assertEqual(engine._row_data(0, "x"), "\x1b[2Ax\x1b[2B\r")
+        self.assertEqual(engine._row_data(1, "x"), "\x1b[1Ax\x1b[1B\r")
+        self.assertEqual(engine._row_data(1, ""), "")
+
+
+class TestStreamOutput(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch(
+            "stimer.output.get_defaults", return_value=TestSTimerEngine.DEFAULTS
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_events_bounded_by_interval(self):
+        clock = ManualClock()
+        stimer = STimer(clock=clock, duration=3600)
+        stimer.start()
+        output = STimerOutput(stimer, renderer="json", stream_interval=60)
+        buffer = io.StringIO()
+        with contextlib.redirect_stdout(buffer):
+            output.start_output()
+        events = [json.loads(line) for line in buffer.getvalue().splitlines()]
+        self.assertEqual(len(events), 61)
+        self.assertEqual(events[0]["event"], "start")
+        self.assertEqual(events[0]["duration"], 3600)
+        self.assertEqual(events[1]["event"], "tick")
+        self.assertAlmostEqual(events[1]["elapsed"], 60, places=3)
+        self.assertEqual(events[-1]["event"], "expired")
+        self.assertEqual(events[-1]["remaining"], 0)
+
+    def test_engine_stream(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        engine = STimerEngine(clock=ManualClock(), fd=write_fd, stream=True)
+        engine.add(STimer(duration=25), label="tea", stream_interval=10)
+        engine.add(STimer(duration=5), label="eggs", stream_interval=10)
+        engine.run()
+        lines = os.read(read_fd, 4096).decode().splitlines()
+        events = [(event["label"], event["event"]) for event in map(json.loads, lines)]
+        self.assertEqual(
+            events,
+            [
+                ("tea", "start"),
+                ("eggs", "start"),
+                ("eggs", "expired"),
+                ("tea", "tick"),
+                ("tea", "tick"),
+                ("tea", "expired"),
+            ],
+        )
+
+    def _run_until_reader_closes(self, args):
+        home = tempfile.TemporaryDirectory()
+        self.addCleanup(home.cleanup)
+        env = dict(os.environ, HOME=home.name)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        process = subprocess.Popen(
+            [sys.executable, "-m", "stimer", "--json", "--interval", "0.05"] + args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+            env=env,
+        )
+        json.loads(process.stdout.readline())
+        running = os.path.join(home.name, ".config", "stimer", "running.json")
+        self.assertTrue(os.path.exists(running))
+        process.stdout.close()
+        stderr = process.communicate(timeout=30)[1]
+        self.assertNotIn(b"Traceback", stderr)
+        self.assertEqual(process.returncode, 1)
+        # The timers are still taken off the running list.
+        self.assertFalse(os.path.exists(running))
+
+    def test_closed_reader(self):
+        self._run_until_reader_closes(["60"])
+
+    def test_engine_closed_reader(self):
+        self._run_until_reader_closes(["60", "90"])
+
+
+class TestOutputStats(unittest.TestCase):
+    def test_lateness_histogram(self):
+        stats = OutputStats()
+        for lateness_us in (-5, 50, 50, 700, 20000, 90000):
+            stats.add_wakeup(lateness_us * 1000)
+        data = stats.as_dict()
+        self.assertEqual(data["wakeups"], 6)
+        self.assertEqual(data["early_wakeups"], 1)
+        self.assertEqual(data["lateness_max_ns"], 90000000)
+        histogram = data["lateness_histogram"]
+        self.assertEqual(histogram["<100us"], 2)
+        self.assertEqual(histogram["<1000us"], 1)
+        self.assertEqual(histogram["<50000us"], 1)
+        self.assertEqual(histogram[">=50000us"], 1)
+        self.assertEqual(sum(histogram.values()), 5)
+        self.assertIn("wake-ups: 6 (1 early)", stats.report())
+
+    def test_output_counts_frames(self):
+        clock = ManualClock()
+        stimer = STimer(clock=clock, duration=60)
+        stimer.start()
+        with mock.patch(
+            "stimer.output.get_defaults", return_value=TestSTimerEngine.DEFAULTS
+        ):
+            output = STimerOutput(
+                stimer, renderer="json", stream_interval=10, stats=True
+            )
+        with contextlib.redirect_stdout(io.StringIO()):
+            output.start_output()
+        self.assertEqual(output.stats.frames_rendered, 5)
+        self.assertEqual(output.stats.wakeups, 6)
+        self.assertEqual(output.stats.early_wakeups, 0)
+
+    def test_stats_off_by_default(self):
+        with mock.patch(
+            "stimer.output.get_defaults", return_value=TestSTimerEngine.DEFAULTS
+        ):
+            self.assertIsNone(STimerOutput(STimer(duration=1)).stats)
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_main_skips_render_modules(self):
+        code = (
+            "import sys, stimer.__main__, stimer.confighandler; "
+            "print(sorted({'progressbar', 'stimer.output', 'stimer.engine', 'sqlite3', "
+            "'numpy', 'asyncio'} & set(sys.modules)))"
+        )
+        output = subprocess.check_output([sys.executable, "-c", code])
+        self.assertEqual(output.strip(), b"[]")
+
 
 if __name__ == "__main__":
     unittest.main()